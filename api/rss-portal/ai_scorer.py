@@ -3,21 +3,54 @@ RSS Portal AIスコアリングモジュール
 Gemini API（Google AI Studio）を使用して記事の関連度をスコアリング
 """
 
+import hashlib
 import json
 import re
+import threading
 import time
+import unicodedata
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import Optional
 
 import requests
 
-from config import USER_INTERESTS, USER_DISLIKES, SITE_URL
+from config import (
+    USER_INTERESTS,
+    USER_DISLIKES,
+    SITE_URL,
+    SCORING_BATCH_SIZE,
+    SCORING_CONTEXT_TTL,
+    SCORING_CONCURRENCY,
+    SCORING_RPM,
+    SCORING_TPM,
+    SCORING_MAX_THROTTLE_RETRIES,
+    SCORING_MAX_ATTEMPTS,
+    SCORING_STRUCTURED_OUTPUT,
+    PREFILTER_ENABLED,
+    PREFILTER_THRESHOLD,
+    PREFILTER_PROVISIONAL_SCORE
+)
 from database import (
     get_unscored_articles,
+    refresh_scoring_priorities,
+    get_scoring_backlog,
+    get_due_retries,
+    record_scoring_failures,
+    clear_scoring_retries,
     update_article_score,
+    bump_data_generation,
+    get_cached_scores,
+    put_cached_scores,
+    evict_score_cache,
     get_liked_articles,
     get_disliked_articles,
     get_clicked_articles
 )
+from prefilter import PREFILTER_SUMMARY, UNTRUSTED_SUMMARIES, load_model, low_probability
 
 # ============================================================
 # API 設定
@@ -28,14 +61,190 @@ except ImportError:
     API_KEY = None
     API_MODEL = "gemini-2.0-flash"
 
-# API エンドポイント
-API_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+# API エンドポイント（config.API_MODEL_URL / 環境変数 RSS_PORTAL_API_MODEL_URL で差し替え可能）
+try:
+    from config import API_MODEL_URL
+except ImportError:
+    API_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+
 
+# 出力トークン上限（要約130文字 + JSONの枠）
+# 構造化出力では前置きやコードブロックが付かないので、その分を削る
+SINGLE_OUTPUT_TOKENS = 256
+BATCH_OUTPUT_TOKENS_PER_ITEM = 200
+# 構造化出力を使わない場合（自由形式のテキストで返る）
+FREEFORM_SINGLE_OUTPUT_TOKENS = 500
+FREEFORM_BATCH_OUTPUT_TOKENS_PER_ITEM = 300
 
-def build_scoring_prompt(title: str, summary: str, feed_name: str) -> str:
-    """スコアリング用のプロンプトを構築"""
+# 構造化出力のスキーマ（responseSchema）
+SINGLE_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "INTEGER", "description": "1-5の関連度スコア"},
+        "summary": {"type": "STRING", "description": "130文字以内の日本語要約"}
+    },
+    "required": ["score", "summary"],
+    "propertyOrdering": ["score", "summary"]
+}
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER", "description": "記事の [id: ...] の数字"},
+            **SINGLE_RESPONSE_SCHEMA["properties"]
+        },
+        "required": ["id", "score", "summary"],
+        "propertyOrdering": ["id", "score", "summary"]
+    }
+}
+
+# 429 に Retry-After が無い場合の待ち時間（秒）
+DEFAULT_RETRY_AFTER = 30
+
+
+# ============================================================
+# レート制限
+# ============================================================
+
+class RateLimited(Exception):
+    """APIが429を返した（retry_after 秒後に再試行できる）"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited (retry after {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """リクエスト数/分・トークン数/分のトークンバケット
+
+    429 を受けたら Retry-After の間すべてのリクエストを止め、
+    送信レートを半分に下げる（成功が続くと少しずつ戻す）。
+    rpm / tpm が 0 の場合はその制限をかけない。
+    """
+
+    def __init__(self, rpm: float, tpm: float = 0, burst: int = 1):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = max(1, burst)
+        self.rate_factor = 1.0
+        self.request_allowance = float(self.burst)
+        self.token_allowance = float(tpm)
+        self.blocked_until = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {'acquired': 0, 'throttled': 0, 'wait_sec': 0.0, 'tokens': 0}
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm:
+            self.request_allowance = min(
+                self.burst,
+                self.request_allowance + elapsed * self.rpm * self.rate_factor / 60
+            )
+        if self.tpm:
+            self.token_allowance = min(
+                self.tpm, self.token_allowance + elapsed * self.tpm / 60
+            )
+
+    def acquire(self, tokens: int = 0):
+        """1リクエスト分（見積もり tokens トークン）の枠が空くまで待つ"""
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self.blocked_until - now
+                if delay <= 0:
+                    need_requests = 1 - self.request_allowance if self.rpm else 0
+                    need_tokens = tokens - self.token_allowance if self.tpm else 0
+                    if need_requests <= 0 and need_tokens <= 0:
+                        if self.rpm:
+                            self.request_allowance -= 1
+                        if self.tpm:
+                            self.token_allowance -= tokens
+                        self.stats['acquired'] += 1
+                        self.stats['wait_sec'] += waited
+                        return
+                    delay = max(
+                        need_requests * 60 / (self.rpm * self.rate_factor) if need_requests > 0 else 0,
+                        need_tokens * 60 / self.tpm if need_tokens > 0 else 0
+                    )
+            time.sleep(delay)
+            waited += delay
+
+    def settle(self, estimated: int, actual: int):
+        """成功したリクエストの見積もりトークン数と実際の差を精算"""
+        with self.lock:
+            if self.tpm:
+                self.token_allowance += estimated - actual
+            self.stats['tokens'] += actual
+            self.rate_factor = min(1.0, self.rate_factor + 0.1)
+
+    def throttle(self, retry_after: float):
+        """429を受けたときに送信を止め、レートを下げる"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.rate_factor = max(0.1, self.rate_factor / 2)
+            self.stats['throttled'] += 1
+
+    def snapshot(self) -> dict:
+        """設定と累計の統計"""
+        with self.lock:
+            return {
+                'rpm': self.rpm,
+                'tpm': self.tpm,
+                'rate_factor': round(self.rate_factor, 2),
+                **self.stats,
+                'wait_sec': round(self.stats['wait_sec'], 2)
+            }
+
+    def stats_since(self, before: dict) -> dict:
+        """snapshot() 時点からの増分（設定値はそのまま）"""
+        now = self.snapshot()
+        for key in self.stats:
+            now[key] = round(now[key] - before.get(key, 0), 2)
+        return now
+
+
+# プロセス内で共有するレート制限（APIからの単発採点とバッチ処理で枠を共有）
+rate_limiter = RateLimiter(SCORING_RPM, SCORING_TPM)
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語は1文字 ≒ 1トークン）"""
+    return len(text.encode('utf-8')) // 3 + 1
+
+
+def parse_retry_after(response) -> float:
+    """429 レスポンスから再試行までの秒数を取り出す"""
+    header = response.headers.get('Retry-After')
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(header)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    # Gemini は本文の RetryInfo に retryDelay（例: "30s"）を入れて返す
+    try:
+        for detail in response.json()['error']['details']:
+            if detail.get('retryDelay'):
+                return float(str(detail['retryDelay']).rstrip('s'))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return DEFAULT_RETRY_AFTER
+
+
+def build_feedback_text() -> str:
+    """過去のフィードバックをプロンプト用のテキストにする"""
 
-    # 過去のフィードバックを取得
     liked = get_liked_articles(5)
     disliked = get_disliked_articles(5)
     clicked = get_clicked_articles(5)
@@ -58,31 +267,141 @@ def build_scoring_prompt(title: str, summary: str, feed_name: str) -> str:
         for a in clicked:
             clicked_text += f"- {a['title']}\n"
 
-    prompt = f"""以下の記事を、ユーザーの興味に基づいて1〜5でスコアリングし、130文字以内の日本語要約を作成してください。
+    return f"{liked_text}{disliked_text}{clicked_text}"
 
-【ユーザーの興味分野】
-{USER_INTERESTS}
 
-【興味がない分野】
-{USER_DISLIKES}
-{liked_text}{disliked_text}{clicked_text}
-【スコア基準】
+SCORE_CRITERIA = """【スコア基準】
 5: 非常に興味深い、すぐ読みたい
 4: 興味あり、時間があれば読みたい
 3: 普通、特に興味を引かない
 2: あまり興味がない
 1: 全く興味がない、読む必要なし
+"""
 
-【記事情報】
-フィード: {feed_name}
-タイトル: {title}
-概要: {summary[:300] if summary else '（概要なし）'}
-
+SINGLE_OUTPUT_FORMAT = """
 【出力形式】
 必ず以下のJSON形式のみで出力してください。それ以外のテキストは不要です。
-{{"score": 数字, "summary": "130文字以内の日本語要約"}}
+{"score": 数字, "summary": "130文字以内の日本語要約"}
 """
-    return prompt
+
+BATCH_OUTPUT_FORMAT = """
+【出力形式】
+必ず以下のJSON配列のみで出力してください。各要素の id は記事の [id: ...] の数字です。それ以外のテキストは不要です。
+[{"id": 数字, "score": 数字, "summary": "130文字以内の日本語要約"}, ...]
+"""
+
+
+# プロンプトの固定部分とモデルのハッシュ（変わったらキャッシュを使わない）
+PROMPT_VERSION = hashlib.sha256("\n".join([
+    API_MODEL, USER_INTERESTS, USER_DISLIKES, SCORE_CRITERIA,
+    SINGLE_OUTPUT_FORMAT, BATCH_OUTPUT_FORMAT
+]).encode('utf-8')).hexdigest()[:16]
+
+
+def content_hash(title: str, summary: str) -> str:
+    """タイトルと概要を正規化したハッシュ（転載・別フィードの同一記事を同一視）"""
+    text = f"{title}\n{(summary or '')[:300]}"
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def format_article(title: str, summary: str, feed_name: str) -> str:
+    """プロンプトに埋め込む記事情報"""
+    return f"""フィード: {feed_name}
+タイトル: {title}
+概要: {summary[:300] if summary else '（概要なし）'}
+"""
+
+
+class ScoringContext:
+    """1回のスコアリング処理で使い回すプロンプトの固定部分
+
+    フィードバックの取得（DB問い合わせ）は生成時の1回だけ行い、
+    記事ごとには記事情報を差し込むだけにする。
+    """
+
+    def __init__(self):
+        self.feedback_text = build_feedback_text()
+        self.created_at = time.monotonic()
+
+        preamble = f"""
+【ユーザーの興味分野】
+{USER_INTERESTS}
+
+【興味がない分野】
+{USER_DISLIKES}
+{self.feedback_text}
+{SCORE_CRITERIA}"""
+
+        self.single_prefix = (
+            "以下の記事を、ユーザーの興味に基づいて1〜5でスコアリングし、"
+            "130文字以内の日本語要約を作成してください。\n"
+            f"{preamble}\n【記事情報】\n"
+        )
+        self.batch_prefix = (
+            "以下の記事一覧の各記事を、ユーザーの興味に基づいてそれぞれ1〜5でスコアリングし、"
+            "130文字以内の日本語要約を作成してください。\n"
+            f"{preamble}\n【記事一覧】\n"
+        )
+
+    def age(self) -> float:
+        """生成からの経過秒数"""
+        return time.monotonic() - self.created_at
+
+    def single_prompt(self, title: str, summary: str, feed_name: str) -> str:
+        """1記事用のプロンプト"""
+        return self.single_prefix + format_article(title, summary, feed_name) + SINGLE_OUTPUT_FORMAT
+
+    def batch_prompt(self, articles: list) -> str:
+        """複数記事用のプロンプト"""
+        items = ""
+        for article in articles:
+            items += f"\n[id: {article['id']}]\n" + format_article(
+                article['title'], article.get('summary') or '', article['feed_name']
+            )
+        return self.batch_prefix + items + BATCH_OUTPUT_FORMAT
+
+
+# score_single_article 用のキャッシュ（短時間だけ使い回す）
+_cached_context = None
+_cached_context_lock = threading.Lock()
+
+
+def get_cached_context(ttl: float = SCORING_CONTEXT_TTL) -> ScoringContext:
+    """TTL内であれば前回の ScoringContext を返す"""
+    global _cached_context
+    with _cached_context_lock:
+        if _cached_context is None or _cached_context.age() > ttl:
+            _cached_context = ScoringContext()
+        return _cached_context
+
+
+def build_scoring_prompt(
+    title: str,
+    summary: str,
+    feed_name: str,
+    context: Optional[ScoringContext] = None
+) -> str:
+    """スコアリング用のプロンプトを構築"""
+
+    if context is None:
+        context = ScoringContext()
+    return context.single_prompt(title, summary, feed_name)
+
+
+def build_batch_scoring_prompt(
+    articles: list,
+    context: Optional[ScoringContext] = None
+) -> str:
+    """複数記事をまとめてスコアリングするプロンプトを構築
+
+    共通部分（興味分野・フィードバック・基準）は1回だけ送る。
+    """
+
+    if context is None:
+        context = ScoringContext()
+    return context.batch_prompt(articles)
 
 
 def extract_json_from_response(text: str) -> Optional[dict]:
@@ -133,12 +452,74 @@ def extract_json_from_response(text: str) -> Optional[dict]:
     return None
 
 
-def call_api(prompt: str) -> Optional[dict]:
-    """APIを呼び出してスコアを取得"""
+def extract_json_array_from_response(text: str) -> list:
+    """バッチのレスポンスから記事ごとの結果を抽出
+
+    配列全体が壊れていても（途中で切れている等）、
+    解析できた要素だけを返す。
+    """
+
+    text = text.strip()
+
+    # 1. コードブロック内の配列を探す
+    code_block = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', text, re.DOTALL)
+    if code_block:
+        text = code_block.group(1)
+
+    # 2. そのままJSONとして解析
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('results') or data.get('articles') or [data]
+        if isinstance(data, list):
+            return [item for item in data if isinstance(item, dict)]
+    except json.JSONDecodeError:
+        pass
+
+    # 3. 要素のオブジェクトを1つずつ取り出す
+    items = []
+    for match in re.finditer(r'\{[^{}]*"id"[^{}]*\}', text):
+        try:
+            items.append(json.loads(match.group()))
+        except json.JSONDecodeError:
+            item = extract_json_from_response(match.group())
+            id_match = re.search(r'"id"\s*:\s*(\d+)', match.group())
+            if item and id_match:
+                item['id'] = int(id_match.group(1))
+                items.append(item)
+    return items
+
+
+def output_token_limit(batch_size: int = 1) -> int:
+    """1リクエストの maxOutputTokens"""
+    if batch_size > 1:
+        per_item = (BATCH_OUTPUT_TOKENS_PER_ITEM if SCORING_STRUCTURED_OUTPUT
+                    else FREEFORM_BATCH_OUTPUT_TOKENS_PER_ITEM)
+        return per_item * batch_size
+    return SINGLE_OUTPUT_TOKENS if SCORING_STRUCTURED_OUTPUT else FREEFORM_SINGLE_OUTPUT_TOKENS
+
+
+def generate_content(
+    prompt: str,
+    max_output_tokens: int = 500,
+    usage: Optional[dict] = None,
+    limiter: Optional[RateLimiter] = None,
+    response_schema: Optional[dict] = None
+) -> Optional[str]:
+    """generateContent を呼び出してレスポンスのテキストを返す
+
+    response_schema を渡すと構造化出力（responseMimeType: application/json）で要求する。
+    usage を渡すとリクエスト数・トークン数を加算し、失敗時は
+    usage['error'] にエラーの分類（例外クラス名や "HTTP 503"）を入れる。
+    送信前に limiter（省略時は共有の rate_limiter）の枠を確保し、
+    429 の場合は RateLimited を送出する。
+    """
 
     if not API_KEY:
         print("[ERROR] API key not configured")
         print("[INFO] Add to config.py: API_KEY = 'your-api-key'")
+        if usage is not None:
+            usage['error'] = "NoAPIKey"
         return None
 
     url = f"{API_MODEL_URL}/{API_MODEL}:generateContent?key={API_KEY}"
@@ -153,9 +534,17 @@ def call_api(prompt: str) -> Optional[dict]:
         ],
         "generationConfig": {
             "temperature": 0.1,
-            "maxOutputTokens": 500
+            "maxOutputTokens": max_output_tokens
         }
     }
+    if response_schema:
+        payload["generationConfig"]["responseMimeType"] = "application/json"
+        payload["generationConfig"]["responseSchema"] = response_schema
+
+    if limiter is None:
+        limiter = rate_limiter
+    estimated = estimate_tokens(prompt) + max_output_tokens
+    limiter.acquire(estimated)
 
     try:
         response = requests.post(
@@ -165,90 +554,473 @@ def call_api(prompt: str) -> Optional[dict]:
             timeout=30
         )
 
+        if usage is not None:
+            usage['requests'] = usage.get('requests', 0) + 1
+
         if response.status_code == 429:
-            print("[WARN] Rate limited. Waiting 60 seconds...")
-            time.sleep(60)
-            return None
+            retry_after = parse_retry_after(response)
+            print(f"[WARN] Rate limited. Retry after {retry_after:.0f} seconds")
+            limiter.throttle(retry_after)
+            raise RateLimited(retry_after)
 
         if response.status_code == 403:
             print("[ERROR] API key invalid or billing not enabled.")
             print("[INFO] Check: https://aistudio.google.com/apikey")
+            if usage is not None:
+                usage['error'] = "HTTP 403"
             return None
 
         response.raise_for_status()
         data = response.json()
 
-        # APIのレスポンス形式からテキストを抽出
-        text = data['candidates'][0]['content']['parts'][0]['text']
-
-        # JSONを抽出
-        result = extract_json_from_response(text)
-        if result:
-            return result
+        meta = data.get('usageMetadata', {})
+        limiter.settle(
+            estimated,
+            meta.get('promptTokenCount', 0) + meta.get('candidatesTokenCount', 0)
+        )
+        if usage is not None:
+            usage['prompt_tokens'] = usage.get('prompt_tokens', 0) + meta.get('promptTokenCount', 0)
+            usage['output_tokens'] = usage.get('output_tokens', 0) + meta.get('candidatesTokenCount', 0)
 
-        print(f"[WARN] Could not parse response: {text[:100]}")
-        return None
+        # APIのレスポンス形式からテキストを抽出
+        candidate = data['candidates'][0]
+        if candidate.get('finishReason') == 'MAX_TOKENS' and usage is not None:
+            usage['truncated'] = usage.get('truncated', 0) + 1
+        return candidate['content']['parts'][0]['text']
 
     except requests.exceptions.RequestException as e:
         print(f"[ERROR] API request failed: {e}")
+        if usage is not None:
+            status = getattr(e.response, 'status_code', None)
+            usage['error'] = f"HTTP {status}" if status else type(e).__name__
         return None
     except (json.JSONDecodeError, KeyError, IndexError) as e:
         print(f"[ERROR] Failed to parse response: {e}")
+        if usage is not None:
+            usage['error'] = "InvalidResponse"
         return None
 
 
-def score_articles(limit: int = 20, delay: float = 1.0) -> dict:
-    """未スコアの記事をスコアリング"""
+def count_parse(usage: Optional[dict], fast: bool):
+    """解析の経路を数える（fast_path: そのままJSON、fallback_parses: 抽出で回収）"""
+    if usage is not None:
+        key = 'fast_path' if fast else 'fallback_parses'
+        usage[key] = usage.get(key, 0) + 1
+
+
+def call_api(
+    prompt: str,
+    usage: Optional[dict] = None,
+    limiter: Optional[RateLimiter] = None
+) -> Optional[dict]:
+    """APIを呼び出してスコアを取得（429 の場合は RateLimited を送出）
+
+    構造化出力の応答はそのまま json.loads し、失敗したときだけ
+    extract_json_from_response で抽出する。
+    """
+
+    text = generate_content(
+        prompt,
+        max_output_tokens=output_token_limit(),
+        usage=usage,
+        limiter=limiter,
+        response_schema=SINGLE_RESPONSE_SCHEMA if SCORING_STRUCTURED_OUTPUT else None
+    )
+    if text is None:
+        return None
+
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict) and 'score' in result:
+            count_parse(usage, fast=True)
+            return result
+    except json.JSONDecodeError:
+        pass
+
+    # JSONを抽出（途中で切れた応答など）
+    result = extract_json_from_response(text)
+    if result:
+        count_parse(usage, fast=False)
+        return result
+
+    print(f"[WARN] Could not parse response: {text[:100]}")
+    if usage is not None:
+        usage['error'] = "ParseError"
+        usage['parse_failures'] = usage.get('parse_failures', 0) + 1
+    return None
+
+
+def call_batch_api(
+    articles: list,
+    usage: Optional[dict] = None,
+    context: Optional[ScoringContext] = None,
+    limiter: Optional[RateLimiter] = None
+) -> dict:
+    """複数記事をまとめてスコアリングし、{記事ID: 結果} を返す
+
+    レスポンスに含まれなかった記事は結果に入らない。
+    429 の場合は RateLimited を送出する。
+    """
+
+    prompt = build_batch_scoring_prompt(articles, context=context)
+    text = generate_content(
+        prompt,
+        max_output_tokens=output_token_limit(len(articles)),
+        usage=usage,
+        limiter=limiter,
+        response_schema=BATCH_RESPONSE_SCHEMA if SCORING_STRUCTURED_OUTPUT else None
+    )
+    if text is None:
+        return {}
+
+    ids = {article['id'] for article in articles}
+    results = {}
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        items = None
+    if isinstance(items, list) and all(isinstance(item, dict) for item in items):
+        count_parse(usage, fast=True)
+    else:
+        # 構造化出力でない・途中で切れた応答は要素ごとに抽出
+        items = extract_json_array_from_response(text)
+        if items:
+            count_parse(usage, fast=False)
+        elif usage is not None:
+            usage['parse_failures'] = usage.get('parse_failures', 0) + 1
+    for item in items:
+        try:
+            article_id = int(item.get('id'))
+        except (TypeError, ValueError):
+            continue
+        if article_id in ids and 'score' in item:
+            results[article_id] = item
+
+    if len(results) < len(ids):
+        print(f"[WARN] Batch response covered {len(results)}/{len(ids)} articles")
+    return results
+
+
+def apply_score(article: dict, ai_result: Optional[dict]) -> Optional[dict]:
+    """AIの結果を記事に保存し、保存した {'score', 'summary'} を返す（無効ならNone）
+
+    データの世代は進めない（呼び出し側がまとめて bump_data_generation を呼ぶ）。
+    """
+
+    if not ai_result or 'score' not in ai_result:
+        return None
+    try:
+        score = int(ai_result['score'])
+    except (TypeError, ValueError):
+        return None
+    score = max(1, min(5, score))  # 1-5に制限
+    summary = str(ai_result.get('summary') or '')[:200]
+
+    update_article_score(article['id'], score, summary, bump=False)
+    print(f"  [{score}] {article['title'][:50]}...")
+    return {'score': score, 'summary': summary}
+
+
+def score_job(
+    articles: list,
+    context: ScoringContext,
+    limiter: RateLimiter
+) -> dict:
+    """ワーカースレッドで1リクエスト分を採点する（DBには書き込まない）
+
+    Returns:
+        {'results': {記事ID: 結果}, 'usage': 使用量, 'throttled': 429ならTrue,
+         'error': 失敗したときのエラーの分類}
+    """
+    usage = {}
+    try:
+        if len(articles) > 1:
+            results = call_batch_api(articles, usage=usage, context=context, limiter=limiter)
+        else:
+            article = articles[0]
+            prompt = build_scoring_prompt(
+                title=article['title'],
+                summary=article['summary'] or '',
+                feed_name=article['feed_name'],
+                context=context
+            )
+            ai_result = call_api(prompt, usage=usage, limiter=limiter)
+            results = {article['id']: ai_result} if ai_result else {}
+        error = usage.pop('error', None)
+        return {'results': results, 'usage': usage, 'throttled': False, 'error': error}
+    except RateLimited:
+        usage.pop('error', None)
+        return {'results': {}, 'usage': usage, 'throttled': True, 'error': None}
+
+
+class ScoringRun:
+    """続けて何度も呼ぶ score_articles で使い回す、1回の実行分の準備（パイプライン用）
+
+    待ち行列の優先度の更新・フィードバック文脈の読み込み・ワーカーのスレッドプールの
+    作成は生成時の1回だけ行い、再試行待ちの記事は取り出し終えるまでの呼び出しでだけ取り出す。
+    close() でスレッドプールを閉じ、スコアキャッシュの古い分を1回だけ削除する。
+    """
+
+    def __init__(self, concurrency: int = SCORING_CONCURRENCY):
+        refresh_scoring_priorities(exclude_summaries=UNTRUSTED_SUMMARIES)
+        self.context = ScoringContext()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self.retries_drained = False
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        evict_score_cache(PROMPT_VERSION)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def score_articles(
+    limit: int = 20,
+    delay: Optional[float] = None,
+    batch_size: int = SCORING_BATCH_SIZE,
+    concurrency: int = SCORING_CONCURRENCY,
+    limiter: Optional[RateLimiter] = None,
+    run: Optional[ScoringRun] = None
+) -> dict:
+    """未スコアの記事をスコアリング
+
+    まず再試行時刻の来たスコアリング失敗の記事を取り出し、残りの枠を
+    待ち行列から優先度（公開日の新しさ・フィードの平均スコア・
+    フィードバック傾向。重みは SCORING_PRIORITY_WEIGHTS）の高い順に埋める。
+    採点に失敗した記事は指数バックオフで再試行し、SCORING_MAX_ATTEMPTS 回
+    失敗したら中立のスコア3を付ける。
+    batch_size が2以上なら、その件数ずつ1回のAPI呼び出しでまとめて採点する。
+    バッチの結果に含まれなかった記事は個別に採点し直す。
+    リクエストは concurrency 本まで並列に送り、送信ペースは limiter
+    （省略時は共有の rate_limiter）で RPM / TPM の枠内に収める。
+    429 で断られた分は失敗扱いにせず、待ち行列に戻して再送する。
+    内容（タイトル + 概要）が同じ記事はスコアキャッシュから採点し、
+    同じ実行内の重複は1件だけAPIに送る。
+
+    delay は旧来の互換用で、指定するとリクエスト間隔の下限として扱う。
+    run（ScoringRun）を渡すと、その準備（優先度の更新済みの待ち行列・フィードバック文脈・
+    スレッドプール）を使い回し、再試行待ちは run で取り出し終えるまでの呼び出しでだけ取り出し、
+    スコアキャッシュの整理は run.close() に任せる（続けて何度も呼ぶパイプライン用）。
+    """
 
     result = {
         'processed': 0,
         'scored': 0,
-        'errors': 0
+        'errors': 0,
+        'retried': 0,
+        'gave_up': 0,
+        'deferred': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'duplicates_in_run': 0,
+        'prefiltered': 0,
+        'requests': 0,
+        'fast_path': 0,
+        'fallback_parses': 0,
+        'parse_failures': 0,
+        'truncated': 0,
+        'prompt_tokens': 0,
+        'output_tokens': 0,
+        'rate_limiter': {},
+        'backlog': {}
     }
 
-    articles = get_unscored_articles(limit)
+    # 再試行待ちを先に消化し、残りの枠で新しい記事を採点
+    retries = []
+    if run is None or not run.retries_drained:
+        retries = get_due_retries(limit)
+    if run is None:
+        refresh_scoring_priorities(exclude_summaries=UNTRUSTED_SUMMARIES)
+    elif len(retries) < limit:
+        # 再試行時刻の来ていた分は取り出し終えた（次の呼び出しからは問い合わせない）
+        run.retries_drained = True
+    result['retried'] = len(retries)
+    articles = retries + (get_unscored_articles(limit - len(retries)) if len(retries) < limit else [])
 
     if not articles:
         print("[INFO] No articles to score")
+        result['backlog'] = get_scoring_backlog()
         return result
 
-    print(f"[INFO] Scoring {len(articles)} articles...")
-    print(f"[INFO] Using model: {API_MODEL}")
+    # 保存した採点結果は、まとめて1回データの世代を進めて見えるようにする
+    # （1件ごとに進めると、ETag と応答キャッシュがその都度無効になる）
+    published = 0
+
+    def publish():
+        nonlocal published
+        saved = result['scored'] + result['prefiltered']
+        if saved > published:
+            bump_data_generation()
+            published = saved
 
+    # スコアキャッシュの確認（同じ実行内の重複は代表の1件だけを採点）
+    hashes = {a['id']: content_hash(a['title'], a['summary']) for a in articles}
+    cached = get_cached_scores(list(hashes.values()), PROMPT_VERSION)
+    followers = {}  # ハッシュ -> 代表と同じ内容の記事
+    to_score = []
     for article in articles:
-        result['processed'] += 1
+        article_hash = hashes[article['id']]
+        if article_hash in cached:
+            apply_score(article, cached[article_hash])
+            result['processed'] += 1
+            result['scored'] += 1
+            result['cache_hits'] += 1
+        elif article_hash in followers:
+            # 同じ実行内の重複（代表の結果を写すだけで、保存済みのキャッシュには当たっていない）
+            followers[article_hash].append(article)
+            result['duplicates_in_run'] += 1
+        else:
+            followers[article_hash] = []
+            to_score.append(article)
+    result['cache_misses'] = len(to_score)
+    new_entries = []
+    failures = {}  # 記事ID -> エラーの分類
+    deferred_ids = set()
 
-        prompt = build_scoring_prompt(
-            title=article['title'],
-            summary=article['summary'] or '',
-            feed_name=article['feed_name']
-        )
+    # ローカル事前判定: 明らかに興味のない記事は暫定スコアを付けてAPIに送らない
+    model = load_model() if PREFILTER_ENABLED else None
+    if model:
+        remaining = []
+        for article in to_score:
+            p = low_probability(model, article['title'], article['summary'], article['feed_name'])
+            if p < PREFILTER_THRESHOLD:
+                remaining.append(article)
+                continue
+            for target in [article, *followers[hashes[article['id']]]]:
+                update_article_score(
+                    target['id'], PREFILTER_PROVISIONAL_SCORE, PREFILTER_SUMMARY, bump=False
+                )
+                result['processed'] += 1
+                result['prefiltered'] += 1
+        to_score = remaining
+    # キャッシュ・事前判定の分（APIの応答を待つ前に出す）
+    publish()
 
-        ai_result = call_api(prompt)
+    def finish(article: dict, saved: Optional[dict]):
+        """代表記事の結果を、同じ内容の記事とキャッシュにも反映"""
+        article_hash = hashes[article['id']]
+        if saved:
+            new_entries.append({'hash': article_hash, **saved})
+        for follower in followers[article_hash]:
+            result['processed'] += 1
+            if saved:
+                apply_score(follower, saved)
+                result['scored'] += 1
+            else:
+                result['errors'] += 1
+                failures[follower['id']] = failures[article['id']]
 
-        if ai_result and 'score' in ai_result:
-            score = int(ai_result['score'])
-            score = max(1, min(5, score))  # 1-5に制限
-            summary = ai_result.get('summary', '')[:200]
+    if limiter is None:
+        limiter = rate_limiter
+        if delay:
+            rpm = 60 / delay
+            if SCORING_RPM:
+                rpm = min(rpm, SCORING_RPM)
+            limiter = RateLimiter(rpm, SCORING_TPM)
+    before = limiter.snapshot()
 
-            update_article_score(article['id'], score, summary)
-            result['scored'] += 1
+    batch_size = max(1, batch_size)
+    concurrency = max(1, concurrency)
+    print(f"[INFO] Scoring {len(to_score)} articles "
+          f"({result['cache_hits']} from cache, {result['duplicates_in_run']} duplicates in run, "
+          f"{result['prefiltered']} prefiltered, "
+          f"batch size: {batch_size}, concurrency: {concurrency})...")
+    print(f"[INFO] Using model: {API_MODEL}")
 
-            print(f"  [{score}] {article['title'][:50]}...")
-        else:
-            result['errors'] += 1
-            # エラー時はスコア3（普通）を設定して次に進む
-            update_article_score(article['id'], 3, "スコアリング失敗")
+    # フィードバック文脈はこの実行中は変わらないので1回だけ読み込む
+    context = ScoringContext() if run is None else run.context
+
+    # 1リクエスト分の仕事（記事リスト + 429で戻された回数）
+    queue = deque(
+        {'articles': to_score[i:i + batch_size], 'throttled': 0}
+        for i in range(0, len(to_score), batch_size)
+    )
+    running = {}
+
+    pool = ThreadPoolExecutor(max_workers=concurrency) if run is None else nullcontext(run.executor)
+    with pool as executor:
+
+        def dispatch():
+            while queue and len(running) < concurrency:
+                job = queue.popleft()
+                running[executor.submit(score_job, job['articles'], context, limiter)] = job
+
+        dispatch()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                outcome = future.result()
+                for key, value in outcome['usage'].items():
+                    result[key] = result.get(key, 0) + value
 
-        # レート制限対策
-        time.sleep(delay)
+                if outcome['throttled']:
+                    job['throttled'] += 1
+                    if job['throttled'] <= SCORING_MAX_THROTTLE_RETRIES:
+                        queue.appendleft(job)
+                    else:
+                        # 未スコアのまま残し、次回の実行で採点する
+                        for a in job['articles']:
+                            deferred = [a, *followers[hashes[a['id']]]]
+                            deferred_ids.update(d['id'] for d in deferred)
+                            result['deferred'] += len(deferred)
+                    continue
 
-    print(f"[INFO] Scored: {result['scored']}/{result['processed']}")
+                for article in job['articles']:
+                    saved = apply_score(article, outcome['results'].get(article['id']))
+                    if saved:
+                        result['processed'] += 1
+                        result['scored'] += 1
+                        finish(article, saved)
+                    elif len(job['articles']) > 1:
+                        # バッチで得られなかった記事は個別に採点
+                        queue.append({'articles': [article], 'throttled': 0})
+                    else:
+                        result['processed'] += 1
+                        result['errors'] += 1
+                        # 未スコアのまま再試行待ちにする
+                        failures[article['id']] = outcome['error'] or "InvalidScore"
+                        finish(article, None)
+            # 終わったリクエストの分をまとめて出す
+            publish()
+            dispatch()
+
+    put_cached_scores(new_entries, PROMPT_VERSION)
+    if run is None:
+        evict_score_cache(PROMPT_VERSION)
+    result['gave_up'] = len(record_scoring_failures(failures))
+    clear_scoring_retries([
+        a['id'] for a in retries if a['id'] not in failures and a['id'] not in deferred_ids
+    ])
+
+    result['rate_limiter'] = limiter.stats_since(before)
+    result['backlog'] = get_scoring_backlog()
+    print(f"[INFO] Scored: {result['scored']}/{result['processed']} "
+          f"({result['requests']} requests, {result['rate_limiter']['throttled']} throttled, "
+          f"{result['deferred']} deferred, cache {result['cache_hits']} hit / "
+          f"{result['cache_misses']} miss, {result['duplicates_in_run']} duplicates in run)")
+    parsed = result['fast_path'] + result['fallback_parses'] + result['parse_failures']
+    if parsed:
+        print(f"[INFO] Responses: {result['fast_path'] / parsed:.0%} parsed directly "
+              f"({result['fallback_parses']} recovered by extractor, "
+              f"{result['parse_failures']} unparseable, {result['truncated']} truncated)")
+    if result['retried'] or result['errors']:
+        print(f"[INFO] Retries: {result['retried']} drained, {result['errors']} failed "
+              f"({result['gave_up']} gave up after {SCORING_MAX_ATTEMPTS} attempts)")
+    print(f"[INFO] Scoring backlog: {result['backlog']['size']} articles, "
+          f"oldest waiting {result['backlog']['oldest_age_hours']}h")
     return result
 
 
-def score_single_article(article_id: int) -> Optional[int]:
-    """単一の記事をスコアリング（API用）"""
+def score_single_article(article_id: int, usage: Optional[dict] = None) -> Optional[int]:
+    """単一の記事をスコアリング（API用）
+
+    usage を渡すとリクエスト数・トークン数・解析失敗数を加算する。
+    """
     from database import get_article_by_id
 
     article = get_article_by_id(article_id)
@@ -258,16 +1030,21 @@ def score_single_article(article_id: int) -> Optional[int]:
     prompt = build_scoring_prompt(
         title=article['title'],
         summary=article['summary'] or '',
-        feed_name=article['feed_name']
+        feed_name=article['feed_name'],
+        context=get_cached_context()
     )
 
-    ai_result = call_api(prompt)
+    try:
+        ai_result = call_api(prompt, usage=usage)
+    except RateLimited:
+        return None
 
     if ai_result and 'score' in ai_result:
         score = int(ai_result['score'])
         score = max(1, min(5, score))
         summary = ai_result.get('summary', '')[:200]
         update_article_score(article_id, score, summary)
+        clear_scoring_retries([article_id])
         return score
 
     return None
@@ -0,0 +1,1011 @@
+#!/usr/bin/env python3
+"""
+RSS Portal ベンチマーク
+本番のDB・外部サービスに触れずに、ローカルのスタブで処理時間を計測する
+
+使用方法:
+  python benchmark.py fetch --feeds 500 --latency 0.05
+  python benchmark.py db --rows 10000 --lookups 20000
+  python benchmark.py plans
+  python benchmark.py score --articles 100 --batch-sizes 1 10 20
+  python benchmark.py priorities --rows 60000 --feeds 50
+  python benchmark.py scorer --articles 100 --malformed-rate 0.05 --truncate-rate 0.05
+  python benchmark.py pipeline --feeds 200 --score-limit 100
+  python benchmark.py json --sizes 100 1000 10000
+  python benchmark.py feedcap --rows 100000 --feeds 200
+  python benchmark.py paging --rows 100000 --page-size 100
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import config
+from mock_gemini import MockGemini
+
+# ベンチマーク用の一時DBに差し替えてから各モジュールを読み込む
+_TMP_DIR = tempfile.TemporaryDirectory(prefix="rss-portal-bench-")
+config.DATABASE_PATH = Path(_TMP_DIR.name) / "bench.db"
+config.DATA_GENERATION_PATH = Path(_TMP_DIR.name) / "generation"
+config.PREFILTER_MODEL_PATH = Path(_TMP_DIR.name) / "prefilter_model.json"
+config.OUTPUT_JSON = Path(_TMP_DIR.name) / "articles.json"
+config.OPML_FILE = Path(_TMP_DIR.name) / "feeds.opml"
+
+
+# ========== 共通ユーティリティ ==========
+
+def start_server(handler_class, port: int = 0) -> ThreadingHTTPServer:
+    """ローカルHTTPサーバーをバックグラウンドで起動"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    """関数を実行して (戻り値, 経過秒) を返す"""
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+
+def percentile(values: list, pct: float) -> float:
+    """パーセンタイル値（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def print_table(title: str, rows: list):
+    """結果を表形式で表示"""
+    print(f"\n[{title}]")
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(str(h)), *(len(str(r[h])) for r in rows)) for h in headers]
+    print("  " + "  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  " + "  ".join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+# ========== フィード取得 ==========
+
+def make_feed_handler(latency: float, items: int):
+    """RSSを返すスタブハンドラーを生成"""
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            feed_id = self.path.strip("/").replace("/", "-")
+            etag = f'"{feed_id}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            entries = "".join(
+                f"<item><title>{feed_id} item {i}</title>"
+                f"<link>http://example.com/{feed_id}/{i}</link>"
+                f"<guid>{feed_id}-{i}</guid>"
+                f"<description>Benchmark item {i}</description></item>"
+                for i in range(items)
+            )
+            body = (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                f'<rss version="2.0"><channel><title>{feed_id}</title>{entries}</channel></rss>'
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FeedHandler
+
+
+def bench_fetch(args):
+    """フィード取得: 逐次取得・並列取得・条件付きGET（304）の所要時間を比較"""
+    import rss_fetcher
+
+    handler = make_feed_handler(args.latency, args.items)
+    servers = [start_server(handler) for _ in range(args.hosts)]
+    feeds = [
+        {
+            "name": f"bench-{i}",
+            "url": f"http://127.0.0.1:{servers[i % args.hosts].server_port}/feed/{i}",
+        }
+        for i in range(args.feeds)
+    ]
+    print(f"[INFO] {args.feeds} feeds on {args.hosts} hosts, latency {args.latency}s")
+
+    rows = []
+    states = {}
+    for label, workers in (
+        ("sequential", 1),
+        ("concurrent", args.concurrency),
+        ("conditional", args.concurrency),
+    ):
+        # conditional: 前回取得した ETag を付けて再取得（スタブは304を返す）
+        targets = [
+            {**feed, "id": i, "etag": states.get(i)} for i, feed in enumerate(feeds)
+        ]
+        fetched, elapsed = timed(
+            rss_fetcher.fetch_feeds_concurrently,
+            targets,
+            max_workers=workers,
+            per_host=args.per_host,
+            max_articles=sys.maxsize,
+        )
+        if label == "concurrent":
+            states = {s["id"]: s["etag"] for s in fetched["states"]}
+        processed = fetched["feeds_processed"]
+        rows.append({
+            "mode": label,
+            "workers": workers,
+            "feeds": processed,
+            "articles": len(fetched["articles"]),
+            "not_modified": fetched["not_modified"],
+            "wall_sec": f"{elapsed:.2f}",
+            "feeds_per_sec": f"{processed / elapsed:.1f}",
+        })
+
+    for server in servers:
+        server.shutdown()
+    print_table("fetch", rows)
+
+
+# ========== データベース ==========
+
+def seed_articles(rows: int, feeds: int = 50, dup_rate: float = 0.0) -> list:
+    """ベンチマーク用の記事を投入して記事IDを返す
+
+    dup_rate の割合で、別GUIDの同一内容の記事（転載）を混ぜる。
+    """
+    import database
+
+    now = time.time()
+    rng = random.Random(1)
+    titles = []
+    for i in range(rows):
+        repost = i and rng.random() < dup_rate
+        titles.append(titles[rng.randrange(i)] if repost else f"Benchmark article {i}")
+    articles = [
+        {
+            "guid": f"bench-{i}",
+            "feed_name": f"feed-{i % feeds}",
+            "title": titles[i],
+            "link": f"http://example.com/{i}",
+            "summary": "benchmark " * 20,
+            "published_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(now - i * 60)
+            ),
+        }
+        for i in range(rows)
+    ]
+    database.insert_articles(articles)
+    with database.get_connection() as conn:
+        return [row["id"] for row in conn.execute("SELECT id FROM articles")]
+
+
+def get_article_by_id_per_call(article_id: int):
+    """旧実装: 呼び出しごとに接続を開閉する get_article_by_id"""
+    conn = sqlite3.connect(str(config.DATABASE_PATH))
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    try:
+        row = conn.execute("SELECT * FROM articles WHERE id = ?", (article_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def bench_db(args):
+    """DB接続: get_article_by_id のスループットを接続方式ごとに比較"""
+    import database
+
+    ids = seed_articles(args.rows)
+    rng = random.Random(0)
+    targets = [rng.choice(ids) for _ in range(args.lookups)]
+    print(f"[INFO] {len(ids)} articles, {len(targets)} lookups")
+
+    rows = []
+    for label, func in (
+        ("per-call connection", get_article_by_id_per_call),
+        ("thread-local (WAL)", database.get_article_by_id),
+    ):
+        _, elapsed = timed(lambda: [func(i) for i in targets])
+        rows.append({
+            "mode": label,
+            "lookups": len(targets),
+            "wall_sec": f"{elapsed:.3f}",
+            "lookups_per_sec": f"{len(targets) / elapsed:,.0f}",
+            "us_per_lookup": f"{elapsed / len(targets) * 1e6:.1f}",
+        })
+    print_table("db: get_article_by_id", rows)
+
+
+def capture_sql(func, *args, **kwargs) -> list:
+    """関数を実行し、発行された SELECT / UPDATE / DELETE 文（WITH 句付きを含む。値を展開済み）を返す"""
+    import database
+
+    statements = []
+    with database.get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            func(*args, **kwargs)
+        finally:
+            conn.set_trace_callback(None)
+    return [
+        sql for sql in statements
+        if sql.lstrip().split(None, 1)[0].upper() in ("WITH", "SELECT", "UPDATE", "DELETE")
+    ]
+
+
+def full_scan_steps(plan: list) -> list:
+    """クエリプランのうち、全件の走査・一時ソートの行を返す
+
+    "SCAN t USING [COVERING] INDEX" もインデックスを端から端まで読むので全件の走査として扱う
+    （検索で読む範囲を絞れているのは "SEARCH" の行だけ）。
+    """
+    bad = []
+    for detail in plan:
+        # "SCAN (subquery-N)" はサブクエリの結果を読むだけで、表の走査ではない
+        if detail.startswith("SCAN (subquery-"):
+            continue
+        if detail.startswith("SCAN "):
+            bad.append(detail)
+        if detail.startswith("USE TEMP B-TREE"):
+            bad.append(detail)
+    return bad
+
+
+def bench_plans(args):
+    """ホットなクエリの EXPLAIN QUERY PLAN を確認（全件走査があれば失敗）"""
+    import database
+
+    seed_articles(args.rows)
+    hot_queries = {
+        "get_scored_articles": lambda: database.get_scored_articles(min_score=3, limit=100),
+        "get_scored_articles (max_per_feed)": lambda: database.get_scored_articles(
+            min_score=3, limit=100, max_per_feed=config.MAX_DISPLAY_PER_FEED
+        ),
+        "get_scored_articles (cursor)": lambda: database.get_scored_articles(
+            min_score=3, limit=100, after=("2026-01-01T00:00:00+00:00", 3, args.rows // 2)
+        ),
+        "get_scored_articles (max_per_feed, cursor)": lambda: database.get_scored_articles(
+            min_score=3, limit=100, max_per_feed=config.MAX_DISPLAY_PER_FEED,
+            after=("2026-01-01T00:00:00+00:00", 3, args.rows // 2)
+        ),
+        "get_unscored_articles": lambda: database.get_unscored_articles(50),
+        "get_scoring_backlog": database.get_scoring_backlog,
+        "get_due_retries": lambda: database.get_due_retries(50),
+        "cleanup_old_articles": database.cleanup_old_articles,
+    }
+
+    # 意図した走査・一時ソート（クエリごとに、読む行数の上限と合わせて書く）
+    capped = {
+        "SCAN feed": "CTE のフィード名の一覧: フィード数の行",
+        "SCAN f": "同上（各フィードの先頭 max_per_feed 件を検索する外側のループ）",
+        "USE TEMP B-TREE FOR ORDER BY": "絞り込んだ後の、フィード数 × max_per_feed 件以下の行",
+    }
+    allowed = {
+        "get_scored_articles (max_per_feed)": capped,
+        "get_scored_articles (max_per_feed, cursor)": capped,
+    }
+
+    rows = []
+    failures = 0
+    with database.get_connection() as conn:
+        for name, func in hot_queries.items():
+            for sql in capture_sql(func):
+                plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                bad = [d for d in full_scan_steps(plan) if d not in allowed.get(name, ())]
+                failures += bool(bad)
+                rows.append({
+                    "query": name,
+                    "ok": "NG" if bad else "OK",
+                    "plan": " / ".join(plan),
+                })
+    print_table("plans", rows)
+    if failures:
+        raise SystemExit(f"[FAIL] {failures} statement(s) use a full scan or temp sort")
+
+
+# ========== AIスコアリング ==========
+
+def use_mock_gemini(mock):
+    """ai_scorer の接続先をモックGeminiサーバーに向ける"""
+    import ai_scorer
+
+    ai_scorer.API_MODEL_URL = mock.url
+    ai_scorer.API_KEY = "benchmark"
+
+
+@contextlib.contextmanager
+def record_request_latencies():
+    """generateContent 1回ごとの所要時間（クライアント側）を記録する"""
+    import ai_scorer
+
+    original = ai_scorer.generate_content
+    latencies = []
+
+    def timed_generate_content(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    ai_scorer.generate_content = timed_generate_content
+    try:
+        yield latencies
+    finally:
+        ai_scorer.generate_content = original
+
+
+def reset_scores():
+    """全記事を未スコアに戻し、スコアキャッシュ・再試行待ちを空にする"""
+    import database
+
+    with database.get_connection() as conn:
+        conn.execute("UPDATE articles SET ai_score = 0, score_summary = NULL")
+        conn.execute("DELETE FROM score_cache")
+        conn.execute("DELETE FROM scoring_retries")
+        conn.commit()
+
+
+def bench_score(args):
+    """AIスコアリング: バッチサイズ・並列数ごとのリクエスト数・トークン数・時間を比較"""
+    import ai_scorer
+
+    mock = MockGemini(
+        latency=args.latency, drop_rate=args.drop_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+    ).start()
+    use_mock_gemini(mock)
+    seed_articles(args.articles, dup_rate=args.dup_rate)
+    print(f"[INFO] {args.articles} articles ({args.dup_rate:.0%} reposts), latency {args.latency}, "
+          f"drop rate {args.drop_rate}, 429 rate {args.throttle_rate}, rpm {args.rpm or 'unlimited'}")
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        for workers in args.workers:
+            reset_scores()
+            limiter = ai_scorer.RateLimiter(args.rpm, 0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                result, elapsed = timed(
+                    ai_scorer.score_articles,
+                    limit=args.articles, batch_size=batch_size,
+                    concurrency=workers, limiter=limiter,
+                )
+            rows.append(score_row(result, elapsed, batch_size=batch_size, workers=workers))
+
+    mock.shutdown()
+    print_table("score", rows)
+
+
+def score_row(result: dict, elapsed: float, **labels) -> dict:
+    """score_articles の結果を100記事あたりの表の行にする"""
+    per_100 = 100 / max(1, result["processed"])
+    return {
+        **labels,
+        "scored": f"{result['scored']}/{result['processed']}",
+        "throttled": result["rate_limiter"].get("throttled", 0),
+        "cache_hits": result["cache_hits"],
+        "dups_in_run": result["duplicates_in_run"],
+        "requests/100": f"{result['requests'] * per_100:.0f}",
+        "prompt_tok/100": f"{result['prompt_tokens'] * per_100:,.0f}",
+        "output_tok/100": f"{result['output_tokens'] * per_100:,.0f}",
+        "wall_sec/100": f"{elapsed * per_100:.2f}",
+    }
+
+
+def bench_scorer(args):
+    """スコアリングの各モードのスループット・レイテンシ・解析失敗率を計測"""
+    import ai_scorer
+    import database
+
+    mock = MockGemini(
+        latency=args.latency, token_latency=args.token_latency,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        error_rate=args.error_rate, malformed_rate=args.malformed_rate,
+        truncate_rate=args.truncate_rate, drop_rate=args.drop_rate,
+    ).start()
+    use_mock_gemini(mock)
+    seed_articles(args.articles)
+    print(f"[INFO] {args.articles} articles, latency {args.latency}, 429 rate {args.throttle_rate}, "
+          f"5xx rate {args.error_rate}, malformed {args.malformed_rate}, "
+          f"truncated {args.truncate_rate}, rpm {args.rpm or 'unlimited'}, "
+          f"structured output {'off' if args.freeform else 'on'}")
+    ai_scorer.SCORING_STRUCTURED_OUTPUT = not args.freeform
+
+    modes = {
+        "single": None,
+        "sequential": (1, 1),
+        "batch": (args.batch_size, 1),
+        "concurrent": (1, args.workers),
+        "batch+concurrent": (args.batch_size, args.workers),
+    }
+    rows = []
+    for mode in args.modes:
+        reset_scores()
+        mock.reset()
+        ai_scorer.rate_limiter = ai_scorer.RateLimiter(args.rpm, 0)
+        with record_request_latencies() as latencies, \
+                contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            if modes[mode] is None:
+                usage = {}
+                ids = [a["id"] for a in database.get_unscored_articles(args.articles)]
+                scored = sum(ai_scorer.score_single_article(i, usage=usage) is not None for i in ids)
+                processed = len(ids)
+            else:
+                batch_size, workers = modes[mode]
+                usage = ai_scorer.score_articles(
+                    limit=args.articles, batch_size=batch_size, concurrency=workers,
+                )
+                scored, processed = usage["scored"], usage["processed"]
+            elapsed = time.perf_counter() - start
+
+        served = mock.stats()
+        responses = served["ok"]
+        rows.append({
+            "mode": mode,
+            "scored": f"{scored}/{processed}",
+            "articles/sec": f"{scored / elapsed:.1f}",
+            "requests": served["requests"],
+            "p50_ms": f"{percentile(latencies, 50) * 1000:.0f}",
+            "p99_ms": f"{percentile(latencies, 99) * 1000:.0f}",
+            "fast_path": f"{usage.get('fast_path', 0) / responses:.1%}" if responses else "-",
+            "parse_fail": f"{usage.get('parse_failures', 0) / responses:.1%}" if responses else "-",
+            "429": served["throttled"],
+            "5xx": served["server_errors"],
+            "out_tok": f"{served['output_tokens']:,}",
+        })
+
+    mock.shutdown()
+    print_table("scorer", rows)
+
+
+# ========== 採点待ち行列の優先度 ==========
+
+def expected_priorities() -> dict:
+    """比較用: 未スコア記事の優先度をPythonで全件計算（既定の重み、除外する要約なし）"""
+    import database
+
+    weights = config.SCORING_PRIORITY_WEIGHTS
+    with database.get_connection() as conn:
+        rows = [dict(row) for row in conn.execute("""
+            SELECT id, feed_name, ai_score, likes, dislikes, clicks, score_priority,
+                   julianday(COALESCE(published_at, fetched_at)) AS day
+            FROM articles
+        """)]
+    feeds = {}
+    for row in rows:
+        feeds.setdefault(row["feed_name"], []).append(row)
+    terms = {}
+    for name, items in feeds.items():
+        scores = [row["ai_score"] for row in items if row["ai_score"] > 0]
+        bias = sum(scores) / len(scores) - 3 if scores else 0
+        affinity = sum(row["likes"] + row["clicks"] - row["dislikes"] for row in items) / (len(items) + 5)
+        terms[name] = weights["feed_score"] * bias + weights["feedback"] * affinity
+    return {
+        row["id"]: (row["score_priority"], weights["recency"] * row["day"] + terms[row["feed_name"]])
+        for row in rows if row["ai_score"] == 0
+    }
+
+
+def bench_priorities(args):
+    """採点待ち行列の優先度の更新: 更新件数・所要時間と、全件計算との一致を確認（不一致なら失敗）"""
+    import database
+
+    seed_articles(args.rows, args.feeds)
+    with database.get_connection() as conn:
+        # フィードごとに平均スコアを変え（フィードの項が0にならないように）、一部を未スコアに戻す
+        conn.execute("""
+            UPDATE articles SET
+                ai_score = CASE WHEN (id * 7919) % 100 < ? THEN 0
+                                ELSE CAST(substr(feed_name, 6) AS INTEGER) % 5 + 1 END,
+                likes = CASE WHEN id % 13 = 0 THEN id % 3 ELSE 0 END
+        """, (int(args.unscored * 100),))
+        conn.commit()
+
+    def check(step: str, func):
+        updated, elapsed = timed(func)
+        expected = expected_priorities()
+        errors = [abs(got - want) for got, want in expected.values() if got is not None]
+        missing = sum(got is None for got, _ in expected.values())
+        return {
+            "step": step,
+            "unscored": len(expected),
+            "updated": updated if updated is not None else "-",
+            "ms": f"{elapsed * 1000:.1f}",
+            "max_error": f"{max(errors, default=0):.1e}",
+            "no_priority": missing,
+            "correct": "yes" if not missing and max(errors, default=0) < 1e-6 else "NO",
+        }
+
+    with database.get_connection() as conn:
+        one_per_feed = [
+            row["id"] for row in conn.execute(
+                "SELECT MIN(id) AS id FROM articles WHERE ai_score = 0 GROUP BY feed_name LIMIT ?",
+                (args.changed_feeds,)
+            )
+        ]
+    new_feed = [
+        {
+            "guid": f"priority-{i}", "feed_name": "feed-new", "title": f"New article {i}",
+            "link": f"http://example.com/new/{i}", "summary": "", "published_at": None,
+        }
+        for i in range(10)
+    ]
+
+    def score_some():
+        for article_id in one_per_feed:
+            database.update_article_score(article_id, 5, "")
+
+    # 引数なし（既定の呼び出し）で、全フィードの項が付くこと
+    rows = [check("first refresh", database.refresh_scoring_priorities)]
+    rows.append(check("no changes", database.refresh_scoring_priorities))
+    score_some()
+    rows.append(check(f"{len(one_per_feed)} feeds scored", database.refresh_scoring_priorities))
+    database.insert_articles(new_feed)
+    with database.get_connection() as conn:
+        missing = conn.execute(
+            "SELECT COUNT(*) FROM articles WHERE feed_name = 'feed-new' AND score_priority IS NULL"
+        ).fetchone()[0]
+    rows.append({
+        "step": "insert (new feed)", "unscored": len(new_feed), "updated": "-", "ms": "-",
+        "max_error": "-", "no_priority": missing, "correct": "yes" if not missing else "NO",
+    })
+    rows.append(check("after insert", database.refresh_scoring_priorities))
+    print_table(f"priorities: {args.rows} articles, {args.feeds} feeds", rows)
+    failures = sum(row["correct"] != "yes" for row in rows)
+    if failures:
+        raise SystemExit(f"[FAIL] {failures} step(s) left priorities out of date")
+
+
+# ========== パイプライン ==========
+
+def reset_articles():
+    """記事と関連テーブル・フィードの取得状態を空にする"""
+    import database
+
+    with database.get_connection() as conn:
+        for table in ("feedback", "scoring_retries", "score_cache", "articles"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("UPDATE feeds SET etag = NULL, last_modified = NULL")
+        conn.commit()
+
+
+def bench_pipeline(args):
+    """取得→スコアリング: 逐次実行とパイプライン（並行実行）の所要時間を比較"""
+    import ai_scorer
+    import database
+    import json_output
+    import pipeline
+    import rss_fetcher
+
+    handler = make_feed_handler(args.fetch_latency, args.items)
+    servers = [start_server(handler) for _ in range(args.hosts)]
+    mock = MockGemini(latency=args.latency).start()
+    use_mock_gemini(mock)
+    database.init_database()
+    for i in range(args.feeds):
+        port = servers[i % args.hosts].server_port
+        database.add_feed(f"bench-{i}", f"http://127.0.0.1:{port}/feed/{i}")
+    print(f"[INFO] {args.feeds} feeds x {args.items} items on {args.hosts} hosts "
+          f"(latency {args.fetch_latency}s), Gemini latency {args.latency}, "
+          f"score limit {args.score_limit}, rpm {args.rpm or 'unlimited'}")
+
+    def sequential():
+        fetched = rss_fetcher.fetch_all_feeds()
+        scored = ai_scorer.score_articles(limit=args.score_limit)
+        json_output.save_output_json()
+        database.cleanup_old_articles()
+        return fetched["inserted"], scored["scored"]
+
+    def streamed():
+        result = pipeline.run_pipeline(score_limit=args.score_limit)
+        return result["fetch"]["inserted"], result["score"].get("scored", 0), result["stages"]
+
+    rows = []
+    stages = {}
+    for label, func in (("sequential", sequential), ("pipeline", streamed)):
+        reset_articles()
+        ai_scorer.rate_limiter = ai_scorer.RateLimiter(args.rpm, 0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            outcome, elapsed = timed(func)
+        if label == "pipeline":
+            stages = outcome[2]
+        rows.append({
+            "mode": label,
+            "inserted": outcome[0],
+            "scored": outcome[1],
+            "wall_sec": f"{elapsed:.2f}",
+        })
+
+    for server in servers:
+        server.shutdown()
+    mock.shutdown()
+    print_table("pipeline", rows)
+    print_table("pipeline stages", [{"stage": name, **s} for name, s in stages.items()])
+
+
+# ========== 同一フィードの件数制限 ==========
+
+def seed_skewed_articles(rows: int, feeds: int) -> dict:
+    """フィードごとの記事数に偏りのある採点済みの記事を投入し、フィードごとの件数を返す
+
+    記事数はパレート分布（少数のフィードが大半を占める）で、公開日は新しい順に1分間隔。
+    """
+    import database
+
+    now = time.time()
+    rng = random.Random(2)
+    articles = []
+    for i in range(rows):
+        feed = int(rng.paretovariate(1.2)) % feeds
+        articles.append({
+            "guid": f"cap-{i}",
+            "feed_name": f"feed-{feed}",
+            "title": f"Benchmark article {i}",
+            "link": f"http://example.com/{i}",
+            "summary": "benchmark " * 20,
+            "published_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(now - i * 60)
+            ),
+        })
+    for i in range(0, rows, 5000):
+        database.insert_articles(articles[i:i + 5000])
+    with database.get_connection() as conn:
+        conn.execute("UPDATE articles SET ai_score = id % 5 + 1")
+        conn.commit()
+        return {
+            row["feed_name"]: row["count"]
+            for row in conn.execute(
+                "SELECT feed_name, COUNT(*) AS count FROM articles GROUP BY feed_name"
+            )
+        }
+
+
+def trim_per_feed(min_score: int, limit: int, max_per_feed: int) -> list:
+    """比較用: 採点済みの記事を全件取得してPythonで同一フィードの件数を絞る"""
+    import database
+
+    articles = database.get_scored_articles(min_score=min_score, limit=2 ** 31)
+    counts = {}
+    result = []
+    for article in articles:
+        counts[article["feed_name"]] = counts.get(article["feed_name"], 0) + 1
+        if counts[article["feed_name"]] <= max_per_feed:
+            result.append(article)
+            if len(result) >= limit:
+                break
+    return result
+
+
+def bench_feedcap(args):
+    """同一フィードの件数制限: 制限なし・SQL（フィードごとの先頭 N 件）・Pythonでの絞り込みを比較"""
+    import database
+
+    counts = seed_skewed_articles(args.rows, args.feeds)
+    top = max(counts.values())
+    print(f"[INFO] {args.rows} articles in {len(counts)} feeds "
+          f"(largest feed: {top}, {top / args.rows:.0%})")
+
+    modes = (
+        ("no cap", lambda: database.get_scored_articles(args.min_score, args.limit)),
+        ("sql top-k per feed", lambda: database.get_scored_articles(
+            args.min_score, args.limit, max_per_feed=args.max_per_feed)),
+        ("python trim", lambda: trim_per_feed(args.min_score, args.limit, args.max_per_feed)),
+    )
+    rows = []
+    expected = None
+    for label, func in modes:
+        func()  # ウォームアップ
+        times = []
+        for _ in range(args.repeat):
+            articles, elapsed = timed(func)
+            times.append(elapsed)
+        per_feed = {}
+        for article in articles:
+            per_feed[article["feed_name"]] = per_feed.get(article["feed_name"], 0) + 1
+        ids = [article["id"] for article in articles]
+        if label != "no cap":
+            expected = expected or ids
+        rows.append({
+            "mode": label,
+            "returned": len(articles),
+            "feeds": len(per_feed),
+            "max_per_feed": max(per_feed.values()) if per_feed else 0,
+            "same_as_sql": "-" if label == "no cap" else ("yes" if ids == expected else "NO"),
+            "ms_p50": f"{percentile(times, 50) * 1000:.1f}",
+            "ms_p99": f"{percentile(times, 99) * 1000:.1f}",
+        })
+    print_table(f"feedcap: limit {args.limit}, max_per_feed {args.max_per_feed}", rows)
+
+    with database.get_connection() as conn:
+        for sql in capture_sql(modes[1][1]):
+            print("\n[plan]")
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                print(f"  {row['detail']}")
+
+
+# ========== ページング ==========
+
+def get_scored_page_by_offset(min_score: int, limit: int, offset: int, max_per_feed: int = 0) -> list:
+    """比較用: OFFSET でのページング（深いページほど読み飛ばす行が増える）
+
+    max_per_feed があれば、全件にフィードごとの番号（ROW_NUMBER）を振ってから絞り込む
+    """
+    import database
+
+    with database.get_connection() as conn:
+        if max_per_feed > 0:
+            cursor = conn.execute("""
+                SELECT id, published_at, ai_score FROM (
+                    SELECT
+                        id, published_at, ai_score,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY feed_name
+                            ORDER BY published_at DESC, ai_score DESC, id DESC
+                        ) AS feed_rank
+                    FROM articles
+                    WHERE ai_score >= ?
+                )
+                WHERE feed_rank <= ?
+                ORDER BY published_at IS NULL, published_at DESC, ai_score DESC, id DESC
+                LIMIT ? OFFSET ?
+            """, (min_score, max_per_feed, limit, offset))
+        else:
+            cursor = conn.execute("""
+                SELECT id, published_at, ai_score FROM articles
+                WHERE ai_score >= ?
+                ORDER BY published_at DESC, ai_score DESC, id DESC
+                LIMIT ? OFFSET ?
+            """, (min_score, limit, offset))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def bench_paging(args):
+    """ページング: カーソル（keyset）と OFFSET の、ページの深さごとの所要時間"""
+    import database
+
+    seed_skewed_articles(args.rows, args.feeds)
+    ordered = database.get_scored_articles(
+        args.min_score, limit=2 ** 31, max_per_feed=args.max_per_feed)
+    print(f"[INFO] {len(ordered)} scored articles (min_score {args.min_score}, "
+          f"max_per_feed {args.max_per_feed}), page size {args.page_size}")
+
+    rows = []
+    for depth in args.depths:
+        offset = min(int(len(ordered) * depth), len(ordered) - 1)
+        last = ordered[offset - 1] if offset else None
+        after = (last["published_at"], last["ai_score"], last["id"]) if last else None
+        modes = (
+            ("cursor", lambda: database.get_scored_articles(
+                args.min_score, args.page_size, max_per_feed=args.max_per_feed, after=after)),
+            ("offset", lambda: get_scored_page_by_offset(
+                args.min_score, args.page_size, offset, args.max_per_feed)),
+        )
+        expected = [article["id"] for article in ordered[offset:offset + args.page_size]]
+        for label, func in modes:
+            times = []
+            for _ in range(args.repeat):
+                page, elapsed = timed(func)
+                times.append(elapsed)
+            rows.append({
+                "depth": f"{depth:.0%}",
+                "offset": offset,
+                "mode": label,
+                "returned": len(page),
+                "correct": "yes" if [article["id"] for article in page] == expected else "NO",
+                "ms_p50": f"{percentile(times, 50) * 1000:.2f}",
+            })
+    print_table(f"paging: max_per_feed {args.max_per_feed}", rows)
+
+
+# ========== JSONエンコード ==========
+
+def make_output_payload(count: int) -> dict:
+    """generate_output_json と同じ形の出力（記事 count 件、DBは使わない）"""
+    articles = [
+        {
+            "id": i,
+            "title": f"Claude Codeで作るWordPressプラグイン入門 その{i}",
+            "link": f"https://example.com/articles/{i}",
+            "feed_name": f"フィード{i % 50}",
+            "summary": ("記事の概要です。実装例とサンプルコードを紹介します。" * 8)[:200],
+            "score": i % 5 + 1,
+            "score_summary": "具体的な実装例があり、すぐに試せる内容",
+            "published_at": f"2026-01-{i % 28 + 1:02d}T10:00:00",
+            "fetched_at": f"2026-01-{i % 28 + 1:02d}T12:00:00",
+            "likes": i % 3,
+            "dislikes": 0,
+            "clicks": i % 7
+        }
+        for i in range(count)
+    ]
+    return {
+        "generated_at": "2026-01-30T12:00:00",
+        "stats": {
+            "total_articles": count,
+            "scored_articles": count,
+            "high_score_articles": count // 2,
+            "displayed": count
+        },
+        "articles": articles
+    }
+
+
+def bench_json(args):
+    """JSONエンコード: 標準json（整形 / 詰める）・FastAPI標準の経路・orjson の時間とメモリ確保量"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    import json_output
+
+    encoders = [
+        ("json indent=2", lambda p: json.dumps(p, ensure_ascii=False, indent=2).encode("utf-8")),
+        ("json compact", lambda p: json.dumps(p, ensure_ascii=False, separators=(",", ":")).encode("utf-8")),
+        ("fastapi default", lambda p: JSONResponse(jsonable_encoder(p)).body),
+    ]
+    if json_output.orjson is not None:
+        orjson = json_output.orjson
+        encoders += [
+            ("orjson indent=2", lambda p: orjson.dumps(p, option=orjson.OPT_INDENT_2)),
+            ("orjson", lambda p: orjson.dumps(p)),
+        ]
+    else:
+        print("[INFO] orjson is not installed (pip install orjson); stdlib json only")
+    print(f"[INFO] dumps_json backend: {json_output.JSON_BACKEND}")
+
+    rows = []
+    for size in args.sizes:
+        payload = make_output_payload(size)
+        repeat = max(3, args.repeat * 100 // size)
+        for label, encode in encoders:
+            encode(payload)  # ウォームアップ
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                body = encode(payload)
+                times.append(time.perf_counter() - start)
+            # メモリ確保量は計測を遅くするので、時間とは別に1回だけ測る
+            tracemalloc.start()
+            encode(payload)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            median = percentile(times, 50)
+            rows.append({
+                "articles": size,
+                "encoder": label,
+                "bytes": f"{len(body):,}",
+                "ms_p50": f"{median * 1000:.2f}",
+                "MB_per_sec": f"{len(body) / median / 1e6:.0f}",
+                "peak_alloc_KB": f"{peak / 1024:,.0f}",
+            })
+    print_table("json encode", rows)
+
+
+# ========== エントリーポイント ==========
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="RSS Portal benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fetch", help="concurrent feed fetching")
+    p.add_argument("--feeds", type=int, default=500)
+    p.add_argument("--hosts", type=int, default=10)
+    p.add_argument("--items", type=int, default=20)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--concurrency", type=int, default=config.FETCH_CONCURRENCY)
+    p.add_argument("--per-host", type=int, default=config.FETCH_PER_HOST_LIMIT)
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser("db", help="connection reuse (get_article_by_id)")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--lookups", type=int, default=20000)
+    p.set_defaults(func=bench_db)
+
+    p = sub.add_parser("plans", help="check that hot queries use indexes")
+    p.add_argument("--rows", type=int, default=1000)
+    p.set_defaults(func=bench_plans)
+
+    p = sub.add_parser("score", help="AI scoring against a mock Gemini server")
+    p.add_argument("--articles", type=int, default=100)
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 20])
+    p.add_argument("--latency", default="0.2", help="seconds or a distribution (see mock_gemini.py)")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, config.SCORING_CONCURRENCY])
+    p.add_argument("--rpm", type=float, default=0, help="0 = unlimited")
+    p.add_argument("--dup-rate", type=float, default=0.0, help="share of reposted articles")
+    p.add_argument("--drop-rate", type=float, default=0.0)
+    p.add_argument("--throttle-rate", type=float, default=0.0)
+    p.add_argument("--retry-after", type=float, default=0.5)
+    p.set_defaults(func=bench_score)
+
+    p = sub.add_parser("priorities", help="scoring queue priority refresh (incremental vs full)")
+    p.add_argument("--rows", type=int, default=60000)
+    p.add_argument("--feeds", type=int, default=50)
+    p.add_argument("--unscored", type=float, default=0.8, help="share of unscored articles")
+    p.add_argument("--changed-feeds", type=int, default=5)
+    p.set_defaults(func=bench_priorities)
+
+    p = sub.add_parser("scorer", help="scorer throughput / latency / parse failures per mode")
+    p.add_argument("--articles", type=int, default=100)
+    p.add_argument("--modes", nargs="+", default=["single", "sequential", "batch", "concurrent",
+                                                  "batch+concurrent"])
+    p.add_argument("--batch-size", type=int, default=config.SCORING_BATCH_SIZE)
+    p.add_argument("--workers", type=int, default=config.SCORING_CONCURRENCY)
+    p.add_argument("--latency", default="lognormal:0.2:0.5",
+                   help="seconds or a distribution (see mock_gemini.py)")
+    p.add_argument("--token-latency", type=float, default=0.002, help="seconds per output token")
+    p.add_argument("--freeform", action="store_true", help="disable structured output")
+    p.add_argument("--rpm", type=float, default=0, help="0 = unlimited")
+    p.add_argument("--throttle-rate", type=float, default=0.0)
+    p.add_argument("--retry-after", type=float, default=0.5)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--malformed-rate", type=float, default=0.0)
+    p.add_argument("--truncate-rate", type=float, default=0.0)
+    p.add_argument("--drop-rate", type=float, default=0.0)
+    p.set_defaults(func=bench_scorer)
+
+    p = sub.add_parser("pipeline", help="sequential vs streaming fetch -> score")
+    p.add_argument("--feeds", type=int, default=200)
+    p.add_argument("--hosts", type=int, default=10)
+    p.add_argument("--items", type=int, default=10)
+    p.add_argument("--fetch-latency", type=float, default=0.2)
+    p.add_argument("--latency", default="0.3", help="Gemini latency (see mock_gemini.py)")
+    p.add_argument("--score-limit", type=int, default=100)
+    p.add_argument("--rpm", type=float, default=0, help="0 = unlimited")
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("feedcap", help="per-feed cap (top-k per feed) on get_scored_articles")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--feeds", type=int, default=200)
+    p.add_argument("--min-score", type=int, default=config.MIN_SCORE_TO_DISPLAY)
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--max-per-feed", type=int, default=config.MAX_DISPLAY_PER_FEED)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_feedcap)
+
+    p = sub.add_parser("paging", help="cursor (keyset) vs OFFSET pagination by page depth")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--feeds", type=int, default=200)
+    p.add_argument("--min-score", type=int, default=config.MIN_SCORE_TO_DISPLAY)
+    p.add_argument("--page-size", type=int, default=100)
+    p.add_argument("--max-per-feed", type=int, default=config.MAX_DISPLAY_PER_FEED,
+                   help="0 = no per-feed cap")
+    p.add_argument("--depths", type=float, nargs="+", default=[0.0, 0.1, 0.5, 0.99])
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_paging)
+
+    p = sub.add_parser("json", help="JSON encoding time / allocations per backend")
+    p.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    p.add_argument("--repeat", type=int, default=20, help="repetitions at 100 articles (scaled down for larger)")
+    p.set_defaults(func=bench_json)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
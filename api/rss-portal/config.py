@@ -13,13 +13,27 @@ OUTPUT_DIR = BASE_DIR / "output"
 
 # SQLite データベース
 DATABASE_PATH = DATA_DIR / "articles.db"
+# データの世代（書き込みのたびに更新。APIのETagに使い、cronとAPIのプロセス間で共有する）
+DATA_GENERATION_PATH = DATA_DIR / "generation"
+
+# SQLite 接続設定（接続ごとに1回だけ設定）
+DB_BUSY_TIMEOUT_MS = 5000          # ロック待ちの最大時間（ミリ秒）
+DB_MMAP_SIZE = 64 * 1024 * 1024    # メモリマップI/Oのサイズ（バイト）
+DB_CACHE_SIZE_KB = 16 * 1024       # ページキャッシュのサイズ（KB）
 
 # 出力ファイル（WordPressから読み込む）
 OUTPUT_JSON = OUTPUT_DIR / "articles.json"
+OUTPUT_JSON_COMPACT = True         # 改行・インデント無しで書き出す（Falseで整形）
+OUTPUT_JSON_PRECOMPRESS = True     # .gz（brotliがあれば .br も）を書き出し時に作る
 
 # API設定
 API_KEY = "your-api-key-here"
 API_MODEL = "gemini-2.0-flash"
+# generateContent のエンドポイント（環境変数でモックサーバー等に差し替え可能）
+API_MODEL_URL = os.environ.get(
+    "RSS_PORTAL_API_MODEL_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models"
+)
 
 # サイト設定
 SITE_URL = "https://your-site.com"
@@ -83,6 +97,43 @@ MAX_ARTICLES_PER_FETCH = 2000  # 1回の取得で処理する最大記事数
 MAX_ITEMS_PER_FEED = 100       # 各フィードから取得する最大記事数
 ARTICLE_RETENTION_DAYS = 14    # 記事を保持する日数
 MAX_DISPLAY_PER_FEED = 10      # 同一フィードから表示する最大記事数
+ARTICLES_CACHE_MAX_ENTRIES = 32  # GET /articles の応答をメモリに保持するクエリパラメーターの組み合わせ数
+
+# AIスコアリング設定
+SCORING_BATCH_SIZE = 10        # 1回のAPI呼び出しでまとめて採点する記事数（1で個別採点）
+SCORING_CONTEXT_TTL = 60       # 単発採点でフィードバック文脈を使い回す秒数
+SCORING_CONCURRENCY = 4        # 同時に送るAPIリクエスト数
+SCORING_RPM = 15               # 1分あたりの最大リクエスト数（0で無制限）
+SCORING_TPM = 1000000          # 1分あたりの最大トークン数（0で無制限）
+SCORING_MAX_THROTTLE_RETRIES = 5  # 429で再送する最大回数（超えたら次回に持ち越し）
+SCORING_STRUCTURED_OUTPUT = True  # 構造化出力（responseSchema）でJSONを返させる
+SCORING_MAX_ATTEMPTS = 4          # 採点に失敗した記事を試す回数（超えたら中立のスコア3）
+SCORING_RETRY_BASE_DELAY = 3600   # 失敗後の再試行までの秒数（失敗するたびに倍）
+SCORING_RETRY_MAX_DELAY = 86400   # 再試行までの最大秒数
+# スコアリング待ち行列の優先度の重み
+#   recency: 公開日が1日新しいごとの加点
+#   feed_score: フィードの過去の平均スコアが3から1ずれるごとの加点
+#   feedback: フィードへの Like/クリック と Dislike の傾向
+SCORING_PRIORITY_WEIGHTS = {"recency": 1.0, "feed_score": 1.0, "feedback": 2.0}
+# 取得→スコアリングのパイプライン（cron_job.py / POST /refresh）
+PIPELINE_FETCH_QUEUE_SIZE = 64     # 取得済み・未挿入のフィード数の上限（メモリの上限）
+PIPELINE_INSERT_BATCH = 200        # まとめて挿入する記事数
+PIPELINE_SCORE_LINGER = 2.0        # スコアリングの1回分がたまるのを待つ最大秒数
+SCORE_CACHE_MAX_ENTRIES = 50000   # スコアキャッシュの最大件数
+SCORE_CACHE_RETENTION_DAYS = 90   # 使われていないキャッシュを保持する日数
+
+# ローカル事前判定（明らかに興味のない記事をAPIに送らない）
+PREFILTER_ENABLED = True
+PREFILTER_THRESHOLD = 0.95        # この確率以上で「興味なし」と判定した記事はAPIを呼ばない
+PREFILTER_PROVISIONAL_SCORE = 2   # 事前判定で付ける暫定スコア
+PREFILTER_MIN_EXAMPLES = 200      # 学習に必要な最低記事数
+PREFILTER_RETRAIN_HOURS = 24      # Cronでモデルを再学習する間隔（時間）
+PREFILTER_MODEL_PATH = DATA_DIR / "prefilter_model.json"
+
+# フィード取得の並列設定
+FETCH_CONCURRENCY = 16         # 同時に取得するフィード数（全体）
+FETCH_PER_HOST_LIMIT = 2       # 同一ホストへの同時接続数
+FETCH_TIMEOUT = 30             # 1フィードあたりのタイムアウト（秒）
 
 # Cron実行間隔（参考情報）
 FETCH_INTERVAL_HOURS = 12      # 12時間ごとに取得
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 RSS Portal - Cronバッチスクリプト
-定期的にRSSフィードを取得してスコアリングを実行
+定期的にRSSフィードを取得してスコアリングを実行（pipeline.py で並行に処理）
 
 使用方法:
   python cron_job.py
@@ -19,31 +19,33 @@ def main():
     print(f"RSS Portal Cron Job - {datetime.now().isoformat()}")
     print("=" * 60)
     
-    # 1. RSSフィード取得
-    print("\n[Step 1] Fetching RSS feeds...")
-    from rss_fetcher import fetch_all_feeds
-    fetch_result = fetch_all_feeds()
-    print(f"  -> Fetched: {fetch_result['fetched']}, Inserted: {fetch_result['inserted']}")
-    
-    # 2. AIスコアリング
-    print("\n[Step 2] Scoring articles with AI...")
-    from ai_scorer import score_articles
-    score_result = score_articles(limit=50, delay=1.5)  # レート制限対策で遅延を入れる
-    print(f"  -> Scored: {score_result['scored']}/{score_result['processed']}")
+    # 1. ローカル事前判定モデルを定期的に再学習
+    print("\n[Step 1] Checking prefilter model...")
+    from prefilter import retrain_if_stale
+    retrain_if_stale()
     
-    # 3. JSON出力
-    print("\n[Step 3] Generating output JSON...")
-    from json_output import save_output_json
-    output_path = save_output_json()
-    print(f"  -> Output: {output_path}")
-    
-    # 4. 古い記事を削除
-    print("\n[Step 4] Cleaning up old articles...")
-    from database import cleanup_old_articles, get_articles_count
-    deleted = cleanup_old_articles()
-    print(f"  -> Deleted: {deleted} old articles")
+    # 2. 取得・AIスコアリングを並行に実行し、最後にJSON出力と古い記事の削除
+    #    （送信ペースは SCORING_RPM / SCORING_TPM で制御）
+    print("\n[Step 2] Fetching and scoring articles (pipeline)...")
+    from pipeline import run_pipeline
+    result = run_pipeline(score_limit=50)
+    fetch_result = result['fetch']
+    score_result = result['score']
+    print(f"  -> Fetched: {fetch_result['fetched']}, Inserted: {fetch_result['inserted']}")
+    print(f"  -> Scored: {score_result.get('scored', 0)}/{score_result.get('processed', 0)} "
+          f"(prefiltered: {score_result.get('prefiltered', 0)})")
+    if score_result.get('backlog'):
+        print(f"  -> Backlog: {score_result['backlog']['size']} articles "
+              f"(oldest waiting {score_result['backlog']['oldest_age_hours']}h)")
+    print(f"  -> Retries: {score_result.get('retried', 0)} drained, "
+          f"{score_result.get('errors', 0)} failed, {score_result.get('gave_up', 0)} gave up")
+    print(f"  -> Output: {result['output']}")
+    print(f"  -> Deleted: {result['deleted']} old articles")
+    for error in result['errors']:
+        print(f"  -> Error: {error}")
     
-    # 5. 統計表示
+    # 3. 統計表示
+    from database import get_articles_count
     stats = get_articles_count()
     print("\n[Summary]")
     print(f"  Total articles: {stats['total']}")
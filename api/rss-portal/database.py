@@ -4,7 +4,10 @@ SQLiteを使用して記事とフィードバックを保存
 """
 
 import logging
+import os
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
@@ -12,7 +15,31 @@ from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
-from config import DATABASE_PATH, ARTICLE_RETENTION_DAYS
+from config import (
+    DATABASE_PATH,
+    DATA_GENERATION_PATH,
+    ARTICLE_RETENTION_DAYS,
+    DB_BUSY_TIMEOUT_MS,
+    DB_MMAP_SIZE,
+    DB_CACHE_SIZE_KB,
+    SCORE_CACHE_MAX_ENTRIES,
+    SCORE_CACHE_RETENTION_DAYS,
+    SCORING_PRIORITY_WEIGHTS,
+    SCORING_MAX_ATTEMPTS,
+    SCORING_RETRY_BASE_DELAY,
+    SCORING_RETRY_MAX_DELAY
+)
+
+# 再試行を使い切った記事に付ける中立のスコア
+FALLBACK_SCORE = 3
+FALLBACK_SUMMARY = "スコアリング失敗"
+
+# スレッドごとに1本の接続を保持して使い回す
+_local = threading.local()
+
+# データの世代ファイルの (stat の値, 世代)
+_generation_cache = (None, 0)
+_generation_lock = threading.Lock()
 
 
 def init_database():
@@ -36,6 +63,10 @@ def init_database():
                 ai_score INTEGER DEFAULT 0,
                 score_summary TEXT,
                 is_read INTEGER DEFAULT 0,
+                likes INTEGER NOT NULL DEFAULT 0,
+                dislikes INTEGER NOT NULL DEFAULT 0,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                score_priority REAL,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -60,31 +91,340 @@ def init_database():
                 category TEXT,
                 is_active INTEGER DEFAULT 1,
                 last_fetched_at TEXT,
+                etag TEXT,
+                last_modified TEXT,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         """)
         
-        # インデックス作成
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_articles_guid ON articles(guid)")
+        # 既存DBへのカラム追加（マイグレーション）
+        ensure_column(cursor, "feeds", "etag", "TEXT")
+        ensure_column(cursor, "feeds", "last_modified", "TEXT")
+        
+        # フィードバック集計カラム（追加時は既存のfeedbackから埋める）
+        added = [
+            ensure_column(cursor, "articles", column, "INTEGER NOT NULL DEFAULT 0")
+            for column in ("likes", "dislikes", "clicks")
+        ]
+        if any(added):
+            backfill_feedback_counters(cursor)
+        
+        # スコアリング待ち行列の優先度（refresh_scoring_priorities で更新）
+        ensure_column(cursor, "articles", "score_priority", "REAL")
+        
+        # feedbackの追加・削除に合わせて集計カラムを更新
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_feedback_insert
+            AFTER INSERT ON feedback
+            BEGIN
+                UPDATE articles SET
+                    likes = likes + (NEW.feedback_type = 'like'),
+                    dislikes = dislikes + (NEW.feedback_type = 'dislike'),
+                    clicks = clicks + (NEW.feedback_type = 'click')
+                WHERE id = NEW.article_id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_feedback_delete
+            AFTER DELETE ON feedback
+            BEGIN
+                UPDATE articles SET
+                    likes = likes - (OLD.feedback_type = 'like'),
+                    dislikes = dislikes - (OLD.feedback_type = 'dislike'),
+                    clicks = clicks - (OLD.feedback_type = 'click')
+                WHERE id = OLD.article_id;
+            END
+        """)
+        
+        # スコアキャッシュ（記事内容のハッシュ → スコア。記事削除後も残す）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS score_cache (
+                content_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                summary TEXT,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                last_used_at TEXT NOT NULL,
+                PRIMARY KEY (content_hash, prompt_version)
+            )
+        """)
+        
+        # スコアリング失敗の再試行待ち（next_attempt_at が NULL なら再試行を使い切った）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scoring_retries (
+                article_id INTEGER PRIMARY KEY,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at TEXT,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY (article_id) REFERENCES articles(id)
+            )
+        """)
+        
+        # スコアリング待ち行列の優先度のうちフィードの項（refresh_scoring_priorities で更新し、
+        # 記事の挿入時にはこれを使って優先度を付ける）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS feed_priority (
+                feed_name TEXT UNIQUE,
+                recency REAL NOT NULL,
+                feed_term REAL NOT NULL
+            )
+        """)
+        
+        # 統計テーブル（1行のみ。トリガーで増分更新し、O(1)で読む）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                articles_total INTEGER NOT NULL DEFAULT 0,
+                articles_scored INTEGER NOT NULL DEFAULT 0,
+                articles_high_score INTEGER NOT NULL DEFAULT 0,
+                feeds_active INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO stats (id) VALUES (1)")
+        if cursor.rowcount:
+            rebuild_stats(cursor)
+        create_stats_triggers(cursor)
+        
+        # インデックス作成（各クエリの WHERE / ORDER BY に合わせる）
+        # guid は UNIQUE 制約の自動インデックスがあるため不要
+        cursor.execute("DROP INDEX IF EXISTS idx_articles_guid")
+        # rebuild_stats の ai_score 条件付き COUNT
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_articles_score ON articles(ai_score DESC)")
+        # cleanup_old_articles の fetched_at 範囲検索
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_articles_fetched ON articles(fetched_at DESC)")
+        # get_scored_articles: 並び順（id まで含めた全順序）どおりに走査し、LIMIT件で打ち切る。
+        # ページングのカーソルの位置からの検索にも使う
+        cursor.execute("DROP INDEX IF EXISTS idx_articles_published_score")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_articles_published_score_id
+            ON articles(published_at DESC, ai_score DESC, id DESC)
+        """)
+        # get_scored_articles の同一フィードの件数制限: フィードごとに新しい順で番号を振る
+        # （ai_score も含めて、ROW_NUMBER の計算を表を読まずにインデックスだけで行う）
+        cursor.execute("DROP INDEX IF EXISTS idx_articles_feed_published")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_articles_feed_published_id
+            ON articles(feed_name, published_at DESC, ai_score DESC, id DESC)
+        """)
+        # get_scoring_backlog: 未スコアの行だけを持つ部分インデックス
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_articles_unscored
+            ON articles(ai_score, fetched_at) WHERE ai_score = 0
+        """)
+        # get_unscored_articles: 未スコアの行を優先度順に取り出す
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_articles_queue
+            ON articles(ai_score, score_priority DESC) WHERE ai_score = 0
+        """)
+        # refresh_scoring_priorities: フィードの項が変わったフィードの未スコアの行だけを書き換える
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_articles_queue_feed
+            ON articles(feed_name) WHERE ai_score = 0
+        """)
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_feedback_article ON feedback(article_id)")
+        # evict_score_cache の古い順の削除
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_score_cache_used ON score_cache(last_used_at)")
+        # get_due_retries: 再試行時刻の来たものを古い順に取り出す
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_scoring_retries_due
+            ON scoring_retries(next_attempt_at) WHERE next_attempt_at IS NOT NULL
+        """)
         
         conn.commit()
+    
+    # 手作業でのDBの変更や、世代ファイルへの書き込み前の異常終了でも古いETagが一致しないように
+    bump_data_generation()
 
 
-@contextmanager
-def get_connection():
-    """データベース接続のコンテキストマネージャー"""
-    conn = sqlite3.connect(str(DATABASE_PATH))
+def ensure_column(cursor, table: str, column: str, definition: str) -> bool:
+    """カラムが無ければ追加（既存DBのマイグレーション用）。追加したらTrue"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column in {row["name"] for row in cursor.fetchall()}:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def backfill_feedback_counters(cursor):
+    """feedbackテーブルから記事ごとの like/dislike/click 数を再計算"""
+    cursor.execute("""
+        UPDATE articles SET
+            likes = (SELECT COUNT(*) FROM feedback f
+                     WHERE f.article_id = articles.id AND f.feedback_type = 'like'),
+            dislikes = (SELECT COUNT(*) FROM feedback f
+                        WHERE f.article_id = articles.id AND f.feedback_type = 'dislike'),
+            clicks = (SELECT COUNT(*) FROM feedback f
+                      WHERE f.article_id = articles.id AND f.feedback_type = 'click')
+    """)
+
+
+def create_stats_triggers(cursor):
+    """articles / feeds の変更に合わせて stats を更新するトリガーを作成"""
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_article_insert
+        AFTER INSERT ON articles
+        BEGIN
+            UPDATE stats SET
+                articles_total = articles_total + 1,
+                articles_scored = articles_scored + (COALESCE(NEW.ai_score, 0) > 0),
+                articles_high_score = articles_high_score + (COALESCE(NEW.ai_score, 0) >= 4)
+            WHERE id = 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_article_delete
+        AFTER DELETE ON articles
+        BEGIN
+            UPDATE stats SET
+                articles_total = articles_total - 1,
+                articles_scored = articles_scored - (COALESCE(OLD.ai_score, 0) > 0),
+                articles_high_score = articles_high_score - (COALESCE(OLD.ai_score, 0) >= 4)
+            WHERE id = 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_article_score
+        AFTER UPDATE OF ai_score ON articles
+        BEGIN
+            UPDATE stats SET
+                articles_scored = articles_scored
+                    + (COALESCE(NEW.ai_score, 0) > 0) - (COALESCE(OLD.ai_score, 0) > 0),
+                articles_high_score = articles_high_score
+                    + (COALESCE(NEW.ai_score, 0) >= 4) - (COALESCE(OLD.ai_score, 0) >= 4)
+            WHERE id = 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_feed_insert
+        AFTER INSERT ON feeds
+        BEGIN
+            UPDATE stats SET feeds_active = feeds_active + (NEW.is_active = 1)
+            WHERE id = 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_feed_delete
+        AFTER DELETE ON feeds
+        BEGIN
+            UPDATE stats SET feeds_active = feeds_active - (OLD.is_active = 1)
+            WHERE id = 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_feed_active
+        AFTER UPDATE OF is_active ON feeds
+        BEGIN
+            UPDATE stats SET
+                feeds_active = feeds_active + (NEW.is_active = 1) - (OLD.is_active = 1)
+            WHERE id = 1;
+        END
+    """)
+
+
+def rebuild_stats(cursor):
+    """stats を実テーブルから再計算（初回作成時・修復用）"""
+    cursor.execute("""
+        UPDATE stats SET
+            articles_total = (SELECT COUNT(*) FROM articles),
+            articles_scored = (SELECT COUNT(*) FROM articles WHERE ai_score > 0),
+            articles_high_score = (SELECT COUNT(*) FROM articles WHERE ai_score >= 4),
+            feeds_active = (SELECT COUNT(*) FROM feeds WHERE is_active = 1)
+        WHERE id = 1
+    """)
+
+
+def open_connection() -> sqlite3.Connection:
+    """新しい接続を開き、PRAGMAを設定する
+
+    WALモードにより、cronの書き込み中もAPIの読み込みがブロックされない。
+    """
+    conn = sqlite3.connect(str(DATABASE_PATH), timeout=DB_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}")
     conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+@contextmanager
+def get_connection():
+    """データベース接続のコンテキストマネージャー
+
+    接続はスレッドごとに1本を保持して再利用する（closeしない）。
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = open_connection()
+        _local.conn = conn
+        _local.depth = 0
+    _local.depth += 1
     try:
         yield conn
     finally:
+        _local.depth -= 1
+        # コミットされずに残った書き込みを次の呼び出しに持ち越さない
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+def close_connection():
+    """現在のスレッドの接続を閉じる
+
+    使い終わったスレッド（更新ジョブ・パイプラインの段など）の最後に呼ぶ。
+    リクエストを処理し続けるスレッドでは呼ばずに使い回す。
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
         conn.close()
 
 
+# ========== データの世代 ==========
+
+def get_data_generation() -> int:
+    """データの世代（記事・スコア・フィードバック・フィードが変わるたびに増える）
+
+    SQLiteには触れず、世代ファイルの stat だけで変化を確認する（変わったときだけ読み直す）。
+    """
+    global _generation_cache
+    try:
+        st = os.stat(DATA_GENERATION_PATH)
+    except FileNotFoundError:
+        return 0
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached_key, value = _generation_cache
+    if key == cached_key:
+        return value
+    try:
+        value = int(DATA_GENERATION_PATH.read_text() or 0)
+    except (OSError, ValueError):
+        return 0
+    _generation_cache = (key, value)
+    return value
+
+
+def bump_data_generation() -> int:
+    """データが変わったことを記録して新しい世代を返す（書き込みのコミット後に呼ぶ）
+
+    世代は「前の世代 + 1」と現在時刻（マイクロ秒）の大きい方。cronとAPIが同時に
+    書き込んでも、異常終了で古い値に戻っても、以前に返した値とは一致しない。
+    """
+    with _generation_lock:
+        value = max(get_data_generation() + 1, time.time_ns() // 1000)
+        DATA_GENERATION_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = DATA_GENERATION_PATH.with_name(
+            f".{DATA_GENERATION_PATH.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        tmp.write_text(str(value))
+        os.replace(tmp, DATA_GENERATION_PATH)
+        return value
+
+
 # ========== 記事関連 ==========
 
 def article_exists(guid: str) -> bool:
@@ -95,6 +435,39 @@ def article_exists(guid: str) -> bool:
         return cursor.fetchone() is not None
 
 
+# SQLiteのバインド変数上限（古いバージョンは999）を超えないように分割
+GUID_QUERY_CHUNK = 900
+
+
+def get_existing_guids(guids: list) -> set:
+    """既に存在するGUIDの集合を返す（IN句でまとめて問い合わせ）"""
+    guids = list(dict.fromkeys(guids))
+    existing = set()
+    if not guids:
+        return existing
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for i in range(0, len(guids), GUID_QUERY_CHUNK):
+            chunk = guids[i:i + GUID_QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(
+                f"SELECT guid FROM articles WHERE guid IN ({placeholders})", chunk
+            )
+            existing.update(row["guid"] for row in cursor.fetchall())
+    return existing
+
+
+# 挿入する記事の優先度（公開日 or 取得日時 と feed_priority のフィードの項）。
+# まだ feed_priority に無いフィードはフィードの項を0として公開日の新しさだけで付け、
+# 次の refresh_scoring_priorities でフィードの項を足す
+# （集計は行が無くても1行返すので、MAX で feed_priority の行の有無を吸収する）
+INSERT_PRIORITY = """
+    (SELECT COALESCE(MAX(p.recency), ?) * julianday(COALESCE(?, CURRENT_TIMESTAMP))
+            + COALESCE(MAX(p.feed_term), 0)
+     FROM feed_priority p WHERE p.feed_name IS ?)
+"""
+
+
 def insert_article(
     guid: str,
     feed_name: str,
@@ -107,58 +480,400 @@ def insert_article(
     with get_connection() as conn:
         cursor = conn.cursor()
         try:
-            cursor.execute("""
-                INSERT INTO articles (guid, feed_name, title, link, summary, published_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (guid, feed_name, title, link, summary, published_at))
+            cursor.execute(f"""
+                INSERT INTO articles (guid, feed_name, title, link, summary, published_at, score_priority)
+                VALUES (?, ?, ?, ?, ?, ?, {INSERT_PRIORITY})
+            """, (
+                guid, feed_name, title, link, summary, published_at,
+                SCORING_PRIORITY_WEIGHTS['recency'], published_at, feed_name
+            ))
             conn.commit()
+            bump_data_generation()
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None
 
 
-def update_article_score(article_id: int, score: int, summary: str = ""):
-    """記事のAIスコアを更新"""
+def insert_articles(articles: list) -> dict:
+    """記事をまとめて挿入（1トランザクション、重複はスキップ）
+
+    articles: {'guid', 'feed_name', 'title', 'link', 'summary', 'published_at'} の辞書のリスト
+
+    Returns:
+        {'inserted': 挿入数, 'duplicates': 重複でスキップした数}
+    """
+    result = {'inserted': 0, 'duplicates': 0}
+    if not articles:
+        return result
+    rows = [
+        (
+            a['guid'], a['feed_name'], a['title'], a['link'],
+            a.get('summary') or "", a.get('published_at'),
+            SCORING_PRIORITY_WEIGHTS['recency'], a.get('published_at'), a['feed_name']
+        )
+        for a in articles
+    ]
+    with get_connection() as conn:
+        try:
+            # rowcount は挿入した行だけを数える（total_changes はトリガーでの更新も含む）
+            cursor = conn.executemany(f"""
+                INSERT OR IGNORE INTO articles
+                    (guid, feed_name, title, link, summary, published_at, score_priority)
+                VALUES (?, ?, ?, ?, ?, ?, {INSERT_PRIORITY})
+            """, rows)
+            result['inserted'] = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if result['inserted']:
+        bump_data_generation()
+    result['duplicates'] = len(rows) - result['inserted']
+    return result
+
+
+def update_article_score(article_id: int, score: int, summary: str = "", bump: bool = True):
+    """記事のAIスコアを更新
+
+    bump が False ならデータの世代を進めない（続けて何件も採点する呼び出し側が、
+    まとめて1回 bump_data_generation を呼ぶ）。
+    """
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             UPDATE articles SET ai_score = ?, score_summary = ? WHERE id = ?
         """, (score, summary, article_id))
         conn.commit()
+    if bump:
+        bump_data_generation()
 
 
 def get_unscored_articles(limit: int = 50) -> list:
-    """スコアリングされていない記事を取得"""
+    """スコアリングされていない記事を優先度の高い順に取得
+
+    優先度は挿入時と refresh_scoring_priorities で付ける（未計算の行は最後）。
+    再試行待ちの記事は get_due_retries で取り出すので含めない。
+    """
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, feed_name, title, link, summary
             FROM articles
             WHERE ai_score = 0
-            ORDER BY fetched_at DESC
+              AND id NOT IN (SELECT article_id FROM scoring_retries)
+            ORDER BY score_priority DESC
             LIMIT ?
         """, (limit,))
         return [dict(row) for row in cursor.fetchall()]
 
 
-def get_scored_articles(min_score: int = 1, limit: int = 100) -> list:
-    """スコアリング済みの記事を取得"""
+def refresh_scoring_priorities(
+    weights: Optional[dict] = None,
+    exclude_summaries: tuple = ()
+) -> int:
+    """未スコア記事の優先度を更新し、書き換えた件数を返す
+
+    優先度 = recency × 公開日（日単位）
+           + feed_score × (フィードの平均スコア - 3)
+           + feedback × フィードへのフィードバック傾向
+    公開日に対して線形なので、計算した時点によらず順序が変わらない。
+    フィードの項（後ろ2つ）は feed_priority に保存し、挿入時にはそれで優先度を付ける。
+    ここで書き換えるのは、前回からフィードの項が変わった（feed_priority に無かった
+    フィードを含む）フィードの未スコア記事と、優先度の無い記事だけ。
+    exclude_summaries の要約を持つ記事（暫定スコア等）は平均に含めない。
+    """
+    weights = {**SCORING_PRIORITY_WEIGHTS, **(weights or {})}
+    recency = weights['recency']
+    # 空の NOT IN (NULL) は常に NULL になり、全フィードの平均が消えるので条件ごと省く
+    excluded = ""
+    if exclude_summaries:
+        placeholders = ",".join("?" * len(exclude_summaries))
+        excluded = f"AND COALESCE(score_summary, '') NOT IN ({placeholders})"
+    with get_connection() as conn:
+        try:
+            cursor = conn.cursor()
+            # フィードごとの平均スコアとフィードバック傾向
+            cursor.execute(f"""
+                SELECT
+                    feed_name,
+                    ? * COALESCE(AVG(CASE WHEN ai_score > 0 {excluded}
+                                 THEN ai_score END) - 3, 0)
+                    + ? * SUM(likes + clicks - dislikes) * 1.0 / (COUNT(*) + 5) AS feed_term
+                FROM articles
+                GROUP BY feed_name
+            """, (weights['feed_score'], *exclude_summaries, weights['feedback']))
+            terms = {row["feed_name"]: row["feed_term"] for row in cursor.fetchall()}
+            cursor.execute("SELECT feed_name, recency, feed_term FROM feed_priority")
+            applied = {row["feed_name"]: (row["recency"], row["feed_term"]) for row in cursor.fetchall()}
+            changed = [
+                (name, term) for name, term in terms.items()
+                if applied.get(name) != (recency, term)
+            ]
+            stale = [name for name in applied if name not in terms] + [name for name, _ in changed]
+
+            cursor.executemany("DELETE FROM feed_priority WHERE feed_name IS ?", [(name,) for name in stale])
+            cursor.executemany(
+                "INSERT INTO feed_priority (feed_name, recency, feed_term) VALUES (?, ?, ?)",
+                [(name, recency, term) for name, term in changed]
+            )
+            updated = 0
+            for name, term in changed:
+                cursor.execute("""
+                    UPDATE articles SET score_priority =
+                        ? * julianday(COALESCE(published_at, fetched_at)) + ?
+                    WHERE ai_score = 0 AND feed_name IS ?
+                """, (recency, term, name))
+                updated += cursor.rowcount
+            cursor.execute("""
+                UPDATE articles SET score_priority = (
+                    SELECT p.recency * julianday(COALESCE(articles.published_at, articles.fetched_at))
+                           + p.feed_term
+                    FROM feed_priority p WHERE p.feed_name IS articles.feed_name
+                )
+                WHERE ai_score = 0 AND score_priority IS NULL
+            """)
+            updated += cursor.rowcount
+            conn.commit()
+            return updated
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def get_due_retries(limit: int = 50) -> list:
+    """再試行時刻を過ぎたスコアリング失敗の記事を、待ちの長い順に取得"""
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT 
-                a.id, a.feed_name, a.title, a.link, a.summary,
-                a.ai_score, a.score_summary, a.published_at, a.fetched_at,
-                COALESCE((SELECT COUNT(*) FROM feedback f WHERE f.article_id = a.id AND f.feedback_type = 'like'), 0) as likes,
-                COALESCE((SELECT COUNT(*) FROM feedback f WHERE f.article_id = a.id AND f.feedback_type = 'dislike'), 0) as dislikes
-            FROM articles a
-            WHERE a.ai_score >= ?
-            ORDER BY a.published_at DESC, a.ai_score DESC
+            SELECT a.id, a.feed_name, a.title, a.link, a.summary, r.attempts
+            FROM scoring_retries r
+            CROSS JOIN articles a  -- 再試行表を外側にして next_attempt_at 順に走査
+            WHERE a.id = r.article_id AND r.next_attempt_at <= ? AND a.ai_score = 0
+            ORDER BY r.next_attempt_at
             LIMIT ?
-        """, (min_score, limit))
+        """, (datetime.now().isoformat(), limit))
         return [dict(row) for row in cursor.fetchall()]
 
 
+def record_scoring_failures(
+    failures: dict,
+    max_attempts: int = SCORING_MAX_ATTEMPTS,
+    base_delay: float = SCORING_RETRY_BASE_DELAY,
+    max_delay: float = SCORING_RETRY_MAX_DELAY
+) -> list:
+    """スコアリングの失敗を記録し、再試行を使い切った記事IDのリストを返す
+
+    failures: {記事ID: エラーの分類}
+    次の再試行は base_delay × 2^(失敗回数-1) 秒後（max_delay で頭打ち）。
+    max_attempts 回失敗した記事には中立のスコア（FALLBACK_SCORE）を付ける。
+    """
+    if not failures:
+        return []
+    ids = list(failures)
+    now = datetime.now()
+    with get_connection() as conn:
+        try:
+            cursor = conn.cursor()
+            attempts = {}
+            for i in range(0, len(ids), GUID_QUERY_CHUNK):
+                chunk = ids[i:i + GUID_QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"""
+                    SELECT article_id, attempts FROM scoring_retries
+                    WHERE article_id IN ({placeholders})
+                """, chunk)
+                attempts.update((row["article_id"], row["attempts"]) for row in cursor.fetchall())
+
+            rows = []
+            exhausted = []
+            for article_id, error in failures.items():
+                count = attempts.get(article_id, 0) + 1
+                if count >= max_attempts:
+                    next_attempt = None
+                    exhausted.append(article_id)
+                else:
+                    delay = min(max_delay, base_delay * 2 ** (count - 1))
+                    next_attempt = (now + timedelta(seconds=delay)).isoformat()
+                rows.append((article_id, count, error, next_attempt, now.isoformat()))
+
+            cursor.executemany("""
+                INSERT INTO scoring_retries
+                    (article_id, attempts, last_error, next_attempt_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (article_id) DO UPDATE SET
+                    attempts = excluded.attempts,
+                    last_error = excluded.last_error,
+                    next_attempt_at = excluded.next_attempt_at,
+                    updated_at = excluded.updated_at
+            """, rows)
+            cursor.executemany("""
+                UPDATE articles SET ai_score = ?, score_summary = ? WHERE id = ?
+            """, [(FALLBACK_SCORE, FALLBACK_SUMMARY, article_id) for article_id in exhausted])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    # 再試行待ちの件数も /stats に出るので、スコアが変わらなくても世代を進める
+    bump_data_generation()
+    return exhausted
+
+
+def clear_scoring_retries(article_ids: list):
+    """採点できた記事を再試行待ちから外す"""
+    if not article_ids:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            "DELETE FROM scoring_retries WHERE article_id = ?",
+            [(article_id,) for article_id in article_ids]
+        )
+        conn.commit()
+    bump_data_generation()
+
+
+def get_retry_stats() -> dict:
+    """再試行待ちの状況（件数・エラー分類ごとの内訳）"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT
+                COUNT(next_attempt_at) AS pending,
+                COALESCE(SUM(next_attempt_at <= ?), 0) AS due,
+                COALESCE(SUM(next_attempt_at IS NULL), 0) AS exhausted,
+                MIN(next_attempt_at) AS next_attempt_at
+            FROM scoring_retries
+        """, (datetime.now().isoformat(),))
+        row = dict(cursor.fetchone())
+        cursor.execute("""
+            SELECT last_error, COUNT(*) AS count FROM scoring_retries
+            WHERE next_attempt_at IS NOT NULL
+            GROUP BY last_error ORDER BY count DESC
+        """)
+        row["errors"] = {r["last_error"] or "unknown": r["count"] for r in cursor.fetchall()}
+        return row
+
+
+def get_scoring_backlog() -> dict:
+    """スコアリング待ちの件数と、最も古い記事の待ち時間"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT articles_total - articles_scored AS size FROM stats WHERE id = 1")
+        size = cursor.fetchone()["size"]
+        cursor.execute("""
+            SELECT MIN(fetched_at) AS oldest,
+                   (julianday('now') - julianday(MIN(fetched_at))) * 24 AS age_hours
+            FROM articles
+            WHERE ai_score = 0
+        """)
+        row = cursor.fetchone()
+        return {
+            "size": size,
+            "oldest_fetched_at": row["oldest"],
+            "oldest_age_hours": round(row["age_hours"], 1) if row["age_hours"] is not None else 0.0
+        }
+
+
+def get_scored_articles(
+    min_score: int = 1,
+    limit: int = 100,
+    max_per_feed: int = 0,
+    after: Optional[tuple] = None
+) -> list:
+    """スコアリング済みの記事を (published_at, ai_score, id) の降順で取得
+
+    max_per_feed: 同一フィードから取得する最大件数（0で制限なし）。
+    フィードごとに新しい順の先頭 max_per_feed 件だけを候補にしてから並べるので、
+    1つのフィードが limit を埋めてしまうことがない。
+    after: 前のページの最後の記事の (published_at, ai_score, id)。その次の記事から返す
+    （制限なしならインデックスをその位置から検索するので、何ページ目でも読む量は limit 件分。
+    制限ありなら読む量はフィード数 × max_per_feed 件以下で、記事の総数にもページの深さにもよらない）。
+    公開日の無い記事は最後に並ぶ。
+    """
+    columns = """
+        a.id, a.feed_name, a.title, a.link, a.summary,
+        a.ai_score, a.score_summary, a.published_at, a.fetched_at,
+        a.likes, a.dislikes, a.clicks
+    """
+    if max_per_feed and max_per_feed > 0:
+        # フィード名の一覧は idx_articles_feed_published_id を飛び飛びに引いて作り
+        # （フィード数回の検索）、フィードごとの先頭 max_per_feed 件も同じインデックスで引く。
+        # 並べ替えるのはこの（フィード数 × max_per_feed 件以下の）候補だけ
+        feeds = """
+            WITH RECURSIVE feed(name) AS (
+                SELECT MIN(feed_name) FROM articles
+                UNION ALL
+                SELECT (SELECT MIN(feed_name) FROM articles WHERE feed_name > feed.name)
+                FROM feed
+                WHERE feed.name IS NOT NULL
+            )
+        """
+        condition = """
+            a.id IN (
+                SELECT x.id
+                FROM feed f
+                JOIN articles x ON x.id IN (
+                    SELECT r.id FROM articles r
+                    WHERE r.feed_name = f.name AND r.ai_score >= ?
+                    ORDER BY r.published_at DESC, r.ai_score DESC, r.id DESC
+                    LIMIT ?
+                )
+                UNION ALL
+                SELECT id FROM (
+                    SELECT r.id FROM articles r
+                    WHERE r.feed_name IS NULL AND r.ai_score >= ?
+                    ORDER BY r.published_at DESC, r.ai_score DESC, r.id DESC
+                    LIMIT ?
+                )
+            )
+        """
+        params = [min_score, max_per_feed, min_score, max_per_feed]
+    else:
+        feeds = ""
+        condition = "a.ai_score >= ?"
+        params = [min_score]
+
+    articles = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # 公開日のある記事（NULLとは大小比較できないので、公開日の無い記事とは分けて読む）
+        if after is None or after[0] is not None:
+            keyset = ""
+            keyset_params = []
+            if after is not None:
+                keyset = "AND (a.published_at, a.ai_score, a.id) < (?, ?, ?)"
+                keyset_params = list(after)
+            cursor.execute(f"""
+                {feeds}
+                SELECT {columns}
+                FROM articles a
+                WHERE {condition}
+                  AND a.published_at IS NOT NULL
+                  {keyset}
+                ORDER BY a.published_at DESC, a.ai_score DESC, a.id DESC
+                LIMIT ?
+            """, params + keyset_params + [limit])
+            articles = [dict(row) for row in cursor.fetchall()]
+        # 公開日の無い記事（並び順の最後）
+        if len(articles) < limit:
+            keyset = ""
+            keyset_params = []
+            if after is not None and after[0] is None:
+                keyset = "AND (a.ai_score, a.id) < (?, ?)"
+                keyset_params = list(after[1:])
+            cursor.execute(f"""
+                {feeds}
+                SELECT {columns}
+                FROM articles a
+                WHERE {condition}
+                  AND a.published_at IS NULL
+                  {keyset}
+                ORDER BY a.ai_score DESC, a.id DESC
+                LIMIT ?
+            """, params + keyset_params + [limit - len(articles)])
+            articles.extend(dict(row) for row in cursor.fetchall())
+    return articles
+
+
 def get_article_by_id(article_id: int) -> Optional[dict]:
     """IDで記事を取得"""
     with get_connection() as conn:
@@ -174,33 +889,150 @@ def cleanup_old_articles() -> int:
     with get_connection() as conn:
         try:
             cursor = conn.cursor()
-            # まず関連するfeedbackを削除
+            # まず関連するfeedback・再試行待ちを削除
             cursor.execute("""
                 DELETE FROM feedback WHERE article_id IN (
                     SELECT id FROM articles WHERE fetched_at < ?
                 )
             """, (cutoff,))
+            cursor.execute("""
+                DELETE FROM scoring_retries WHERE article_id IN (
+                    SELECT id FROM articles WHERE fetched_at < ?
+                )
+            """, (cutoff,))
             # 次に記事を削除
             cursor.execute("DELETE FROM articles WHERE fetched_at < ?", (cutoff,))
             deleted = cursor.rowcount
             conn.commit()
-            return deleted
         except Exception:
             conn.rollback()
             raise
+    if deleted:
+        bump_data_generation()
+    return deleted
 
 
 def get_articles_count() -> dict:
-    """記事の統計情報"""
+    """記事の統計情報（statsテーブルから読む）"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT articles_total, articles_scored, articles_high_score
+            FROM stats WHERE id = 1
+        """)
+        row = cursor.fetchone()
+        return {
+            "total": row["articles_total"],
+            "scored": row["articles_scored"],
+            "high_score": row["articles_high_score"]
+        }
+
+
+def repair_stats() -> dict:
+    """statsテーブルを再計算して修復し、修復後の値を返す"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO stats (id) VALUES (1)")
+        rebuild_stats(cursor)
+        conn.commit()
+        bump_data_generation()
+        cursor.execute("SELECT * FROM stats WHERE id = 1")
+        return dict(cursor.fetchone())
+
+
+def get_training_examples() -> list:
+    """事前判定モデルの学習用に、スコア済みまたはフィードバックのある記事を取得"""
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) as total FROM articles")
-        total = cursor.fetchone()["total"]
-        cursor.execute("SELECT COUNT(*) as scored FROM articles WHERE ai_score > 0")
-        scored = cursor.fetchone()["scored"]
-        cursor.execute("SELECT COUNT(*) as high FROM articles WHERE ai_score >= 4")
-        high = cursor.fetchone()["high"]
-        return {"total": total, "scored": scored, "high_score": high}
+        cursor.execute("""
+            SELECT id, feed_name, title, summary, ai_score, score_summary,
+                   likes, dislikes, clicks
+            FROM articles
+            WHERE ai_score > 0 OR likes > 0 OR dislikes > 0 OR clicks > 0
+        """)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+# ========== スコアキャッシュ関連 ==========
+
+def get_cached_scores(hashes: list, prompt_version: str) -> dict:
+    """キャッシュ済みのスコアを {ハッシュ: {'score', 'summary'}} で返す
+
+    見つかった行は hits と last_used_at を更新する。
+    """
+    hashes = list(dict.fromkeys(hashes))
+    found = {}
+    if not hashes:
+        return found
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for i in range(0, len(hashes), GUID_QUERY_CHUNK):
+            chunk = hashes[i:i + GUID_QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"""
+                SELECT content_hash, score, summary FROM score_cache
+                WHERE prompt_version = ? AND content_hash IN ({placeholders})
+            """, [prompt_version, *chunk])
+            for row in cursor.fetchall():
+                found[row["content_hash"]] = {"score": row["score"], "summary": row["summary"]}
+        if found:
+            now = datetime.now().isoformat()
+            cursor.executemany("""
+                UPDATE score_cache SET hits = hits + 1, last_used_at = ?
+                WHERE content_hash = ? AND prompt_version = ?
+            """, [(now, h, prompt_version) for h in found])
+            conn.commit()
+    return found
+
+
+def put_cached_scores(entries: list, prompt_version: str):
+    """スコアをキャッシュに保存
+
+    entries: {'hash', 'score', 'summary'} の辞書のリスト
+    """
+    if not entries:
+        return
+    now = datetime.now().isoformat()
+    with get_connection() as conn:
+        conn.executemany("""
+            INSERT INTO score_cache
+                (content_hash, prompt_version, score, summary, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (content_hash, prompt_version) DO UPDATE SET
+                score = excluded.score,
+                summary = excluded.summary,
+                last_used_at = excluded.last_used_at
+        """, [(e['hash'], prompt_version, e['score'], e['summary'], now, now) for e in entries])
+        conn.commit()
+
+
+def evict_score_cache(
+    prompt_version: str,
+    max_entries: int = SCORE_CACHE_MAX_ENTRIES,
+    retention_days: int = SCORE_CACHE_RETENTION_DAYS
+) -> int:
+    """スコアキャッシュを整理して削除件数を返す
+
+    古いプロンプトのエントリ、retention_days 以上使われていないエントリ、
+    max_entries を超えた分（最終利用が古い順）を削除する。
+    """
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM score_cache WHERE prompt_version != ? OR last_used_at < ?
+        """, (prompt_version, cutoff))
+        deleted = cursor.rowcount
+        cursor.execute("""
+            DELETE FROM score_cache WHERE rowid IN (
+                SELECT rowid FROM score_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (max_entries,))
+        deleted += cursor.rowcount
+        conn.commit()
+        return deleted
 
 
 # ========== フィードバック関連 ==========
@@ -219,7 +1051,8 @@ def add_feedback(article_id: int, feedback_type: str) -> bool:
             VALUES (?, ?)
         """, (article_id, feedback_type))
         conn.commit()
-        return True
+    bump_data_generation()
+    return True
 
 
 def get_liked_articles(limit: int = 10) -> list:
@@ -274,13 +1107,30 @@ def get_active_feeds() -> list:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT id, name, url, category
+            SELECT id, name, url, category, etag, last_modified
             FROM feeds
             WHERE is_active = 1
         """)
         return [dict(row) for row in cursor.fetchall()]
 
 
+def update_feeds_fetch_state(states: list):
+    """フィードの取得状態（ETag / Last-Modified / 取得日時）を一括更新
+
+    states: {'id', 'etag', 'last_modified'} の辞書のリスト
+    """
+    if not states:
+        return
+    now = datetime.now().isoformat()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            UPDATE feeds SET etag = ?, last_modified = ?, last_fetched_at = ?
+            WHERE id = ?
+        """, [(s['etag'], s['last_modified'], now, s['id']) for s in states])
+        conn.commit()
+
+
 def add_feed(name: str, url: str, category: str = "") -> bool:
     """フィードを追加（重複時はスキップ）"""
     with get_connection() as conn:
@@ -291,9 +1141,10 @@ def add_feed(name: str, url: str, category: str = "") -> bool:
                 VALUES (?, ?, ?)
             """, (name, url, category))
             conn.commit()
-            return True
         except sqlite3.IntegrityError:
             return False
+    bump_data_generation()
+    return True
 
 
 def import_feeds_from_opml(opml_path: Path) -> int:
@@ -342,12 +1193,22 @@ def import_feeds_from_opml(opml_path: Path) -> int:
 
 
 def get_feeds_count() -> int:
-    """登録されたフィード数を取得"""
+    """登録されたフィード数を取得（statsテーブルから読む）"""
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) as cnt FROM feeds WHERE is_active = 1")
-        return cursor.fetchone()["cnt"]
+        cursor.execute("SELECT feeds_active FROM stats WHERE id = 1")
+        return cursor.fetchone()["feeds_active"]
 
 
 # 初期化
 init_database()
+
+
+if __name__ == "__main__":
+    # 統計テーブルの修復: python database.py repair-stats
+    import sys
+
+    if sys.argv[1:] == ["repair-stats"]:
+        print(f"[INFO] Stats repaired: {repair_stats()}")
+    else:
+        print("Usage: python database.py repair-stats")
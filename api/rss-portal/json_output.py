@@ -3,20 +3,83 @@ RSS Portal JSON出力モジュール
 WordPressから読み込むためのJSONファイルを生成
 """
 
+import gzip
 import json
+import os
 from datetime import datetime
+from pathlib import Path
 
-from config import OUTPUT_JSON, MIN_SCORE_TO_DISPLAY
+from config import (
+    OUTPUT_JSON,
+    OUTPUT_JSON_COMPACT,
+    OUTPUT_JSON_PRECOMPRESS,
+    MIN_SCORE_TO_DISPLAY,
+    MAX_DISPLAY_PER_FEED
+)
 from database import get_scored_articles, get_articles_count
+from pagination import InvalidCursor, decode_cursor, encode_cursor
 
+# brotli は任意（未インストールなら .gz だけを作る）
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-def generate_output_json(min_score: int = None, limit: int = 100) -> dict:
-    """記事一覧のJSONを生成"""
+# orjson は任意（未インストールなら標準の json でエンコードする）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+# 事前圧縮ファイルの Content-Encoding と拡張子（優先する順）
+COMPRESSED_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def article_sort_key(cursor: str, params: dict) -> tuple:
+    """記事一覧のカーソルから (published_at, ai_score, id) を取り出す"""
+    key = decode_cursor(cursor, "articles", params)
+    valid = (
+        len(key) == 3
+        and (key[0] is None or isinstance(key[0], str))
+        and all(isinstance(v, int) and not isinstance(v, bool) for v in key[1:])
+    )
+    if not valid:
+        raise InvalidCursor("Malformed cursor")
+    return key
+
+
+def generate_output_json(
+    min_score: int = None,
+    limit: int = 100,
+    max_per_feed: int = None,
+    cursor: str = None
+) -> dict:
+    """記事一覧のJSONを生成
+
+    max_per_feed: 同一フィードの最大件数（0で制限なし）
+    cursor: 前のページの next_cursor（不正なら InvalidCursor）
+    """
     
     if min_score is None:
         min_score = MIN_SCORE_TO_DISPLAY
+    if max_per_feed is None:
+        max_per_feed = MAX_DISPLAY_PER_FEED
+    params = {"min_score": min_score, "max_per_feed": max_per_feed}
+    after = article_sort_key(cursor, params) if cursor else None
     
-    articles = get_scored_articles(min_score=min_score, limit=limit)
+    # 1件多く読んで、次のページがあるかを確かめる
+    articles = get_scored_articles(
+        min_score=min_score, limit=limit + 1, max_per_feed=max_per_feed, after=after
+    )
+    next_cursor = None
+    if len(articles) > limit:
+        articles = articles[:limit]
+        last = articles[-1]
+        next_cursor = encode_cursor(
+            "articles", (last['published_at'], last['ai_score'], last['id']), params
+        )
     stats = get_articles_count()
     
     output = {
@@ -27,6 +90,7 @@ def generate_output_json(min_score: int = None, limit: int = 100) -> dict:
             "high_score_articles": stats['high_score'],
             "displayed": len(articles)
         },
+        "next_cursor": next_cursor,
         "articles": []
     }
     
@@ -42,23 +106,79 @@ def generate_output_json(min_score: int = None, limit: int = 100) -> dict:
             "published_at": article['published_at'],
             "fetched_at": article['fetched_at'],
             "likes": article['likes'],
-            "dislikes": article['dislikes']
+            "dislikes": article['dislikes'],
+            "clicks": article['clicks']
         })
     
     return output
 
 
+def dumps_json(obj, indent: bool = False) -> bytes:
+    """UTF-8のJSONバイト列にする（非ASCII文字はエスケープしない）
+
+    orjson があれば使い、無ければ標準の json を使う。indent=True で2スペースの整形。
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def compressed_path(encoding: str, path: Path = None) -> Path:
+    """事前圧縮ファイルのパス（articles.json.br / articles.json.gz）"""
+    path = path or OUTPUT_JSON
+    suffix = dict(COMPRESSED_VARIANTS)[encoding]
+    return path.with_name(path.name + suffix)
+
+
+def write_atomic(path: Path, data: bytes):
+    """一時ファイルに書いてから置き換える（読み込み中の側には古い内容か新しい内容の全体が見える）"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    """事前圧縮（リクエストごとには圧縮しないので最大の圧縮率で）"""
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    # mtime=0: 内容が同じなら同じバイト列になる
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
 def save_output_json() -> str:
-    """JSONファイルを保存"""
+    """JSONファイルを保存（事前圧縮した .gz / .br も一緒に書き出す）"""
     
     OUTPUT_JSON.parent.mkdir(parents=True, exist_ok=True)
     
     output = generate_output_json()
     
-    with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    data = dumps_json(output, indent=not OUTPUT_JSON_COMPACT)
+    
+    # 圧縮ファイルを先に置き換える（本体より古い圧縮ファイルが残らないように）
+    sizes = []
+    for encoding, suffix in COMPRESSED_VARIANTS:
+        path = compressed_path(encoding)
+        if not OUTPUT_JSON_PRECOMPRESS or (encoding == "br" and brotli is None):
+            # 作らない圧縮ファイルは、前回までの古い内容を配信しないよう削除
+            path.unlink(missing_ok=True)
+            continue
+        compressed = compress(encoding, data)
+        write_atomic(path, compressed)
+        sizes.append(f"{suffix} {len(compressed)}")
+    write_atomic(OUTPUT_JSON, data)
     
-    print(f"[INFO] Saved {len(output['articles'])} articles to {OUTPUT_JSON}")
+    detail = f" ({', '.join(sizes)} bytes)" if sizes else ""
+    print(f"[INFO] Saved {len(output['articles'])} articles to {OUTPUT_JSON} "
+          f"[{len(data)} bytes]{detail}")
     return str(OUTPUT_JSON)
 
 
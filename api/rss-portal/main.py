@@ -3,24 +3,40 @@ RSS Portal - FastAPI メインアプリケーション
 ColorfulBox共有サーバー用
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
-from typing import Optional
 
-from config import CORS_ORIGINS, OUTPUT_JSON, MIN_SCORE_TO_DISPLAY
+from config import (
+    CORS_ORIGINS,
+    OUTPUT_JSON,
+    MIN_SCORE_TO_DISPLAY,
+    MAX_DISPLAY_PER_FEED,
+    ARTICLES_CACHE_MAX_ENTRIES
+)
 from database import (
     add_feedback,
     get_article_by_id,
     get_scored_articles,
     get_articles_count,
-    cleanup_old_articles,
-    get_feeds_count
+    get_feeds_count,
+    get_scoring_backlog,
+    get_retry_stats,
+    get_data_generation,
+    close_connection
 )
-from rss_fetcher import fetch_all_feeds
-from ai_scorer import score_articles
-from json_output import generate_output_json, save_output_json
+from json_output import COMPRESSED_VARIANTS, compressed_path, dumps_json, generate_output_json
+from pagination import InvalidCursor
+from pipeline import STAGES, new_metrics, run_pipeline
 
 
 # FastAPIアプリ初期化
@@ -51,14 +67,119 @@ class RefreshRequest(BaseModel):
     score_limit: Optional[int] = 50
 
 
+# ========== JSONレスポンス ==========
+
+class FastJSONResponse(JSONResponse):
+    """dumps_json（orjson があれば orjson）でエンコードするJSONレスポンス
+
+    エンドポイントからこのクラスを直接返すと、FastAPIの jsonable_encoder も通らない。
+    """
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+
+# ========== 条件付きGET（ETag） ==========
+
+# /stats の待ち時間・再試行時刻は時間とともに変わるので、ETagをこの秒数で区切る
+STATS_ETAG_INTERVAL = 60
+
+
+def make_etag(name: str, generation: int, *params) -> str:
+    """データの世代とクエリパラメーターからETagを作る（データが変わるまで同じ値）"""
+    parts = [name, str(generation), *(str(p) for p in params)]
+    return '"' + "-".join(parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match のどれかが一致するか（弱い比較なので W/ は無視する）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in header.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def not_modified(etag: str) -> Response:
+    """304 Not Modified（本文なし）"""
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+# ========== 応答キャッシュ ==========
+
+class ResponseCache:
+    """エンコード済みの応答本文のLRUキャッシュ
+
+    データの世代ごとに保持し、世代が変わったら（リフレッシュ・フィードバック・
+    古い記事の削除）全て捨てる。max_entries を超えたら最も使われていないものから捨てる。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # キー -> 本文（古い順）
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, generation: int) -> Optional[bytes]:
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._generation = generation
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, generation: int, body: bytes):
+        with self._lock:
+            # 作っている間に世代が進んでいたら、次の世代のキャッシュに混ぜない
+            if generation != self._generation or self.max_entries <= 0:
+                return
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+_articles_cache = ResponseCache(ARTICLES_CACHE_MAX_ENTRIES)
+
+
 # ========== エンドポイント ==========
 
-@app.get("/")
-async def root():
+@app.get("/", response_class=FastJSONResponse)
+async def root(request: Request):
     """ヘルスチェック"""
+    etag = make_etag("root", get_data_generation())
+    if etag_matches(request, etag):
+        return not_modified(etag)
     stats = get_articles_count()
     feeds = get_feeds_count()
-    return {
+    return FastJSONResponse({
         "status": "ok",
         "service": "RSS Portal API",
         "stats": {
@@ -66,26 +187,90 @@ async def root():
             "articles": stats['total'],
             "scored": stats['scored']
         }
-    }
+    }, headers={"ETag": etag})
 
 
-@app.get("/articles")
+@app.get("/articles", response_class=FastJSONResponse)
 async def get_articles(
+    request: Request,
     min_score: int = MIN_SCORE_TO_DISPLAY,
-    limit: int = 100
+    limit: int = 100,
+    max_per_feed: int = MAX_DISPLAY_PER_FEED,
+    cursor: Optional[str] = None
 ):
-    """記事一覧を取得"""
-    return generate_output_json(min_score=min_score, limit=limit)
+    """記事一覧を取得
+
+    max_per_feed: 同一フィードの最大件数（0で制限なし）
+    cursor: 前のページの next_cursor（pagination.py のカーソルの約束に従う）
+
+    データが変わっていなければ304を、初めてのクライアントにもキャッシュ済みの
+    本文を返す（どちらもSQLiteに触れず、JSONの再エンコードもしない）。
+    """
+    generation = get_data_generation()
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    # カーソルは長くなりうるので、ETagにはハッシュを入れる
+    cursor_tag = hashlib.sha256(cursor.encode()).hexdigest()[:16] if cursor else ""
+    etag = make_etag("articles", generation, min_score, limit, max_per_feed, cursor_tag)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    key = (min_score, limit, max_per_feed, cursor)
+    body = _articles_cache.get(key, generation)
+    if body is None:
+        try:
+            output = generate_output_json(
+                min_score=min_score, limit=limit, max_per_feed=max_per_feed, cursor=cursor
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        body = dumps_json(output)
+        _articles_cache.put(key, generation, body)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+def accepted_encodings(header: str) -> set:
+    """Accept-Encoding のうち受け付ける（q=0 でない）エンコーディング"""
+    accepted = set()
+    for part in header.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
 
 
 @app.get("/articles.json")
-async def get_articles_json():
-    """静的JSONファイルを返す（WordPressから直接参照用）"""
+async def get_articles_json(request: Request):
+    """静的JSONファイルを返す（WordPressから直接参照用）
+
+    書き出し時に作った .br / .gz があれば、Accept-Encoding に合わせてそのまま返す
+    （リクエストごとには圧縮しない）。
+    """
     if OUTPUT_JSON.exists():
+        headers = {
+            "Cache-Control": "public, max-age=300",  # 5分キャッシュ
+            "Vary": "Accept-Encoding"
+        }
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        path = OUTPUT_JSON
+        for encoding, _ in COMPRESSED_VARIANTS:
+            candidate = compressed_path(encoding)
+            if (encoding in accepted or "*" in accepted) and candidate.exists():
+                path = candidate
+                headers["Content-Encoding"] = encoding
+                break
         return FileResponse(
-            path=str(OUTPUT_JSON),
+            path=str(path),
             media_type="application/json",
-            headers={"Cache-Control": "public, max-age=300"}  # 5分キャッシュ
+            headers=headers
         )
     # ファイルが無ければ動的生成
     return generate_output_json()
@@ -106,66 +291,152 @@ async def post_feedback(request: FeedbackRequest):
     return {"status": "ok", "article_id": request.article_id, "feedback": request.feedback}
 
 
-@app.post("/refresh")
-async def refresh_feeds(
-    background_tasks: BackgroundTasks,
-    request: RefreshRequest = None
-):
-    """フィードを更新（バックグラウンド実行）"""
+# ========== リフレッシュのジョブ管理 ==========
+
+# 状態を保持しておく完了済みジョブの数
+REFRESH_JOB_HISTORY = 20
+
+
+class RefreshJob:
+    """1回のリフレッシュ（専用スレッドで run_pipeline を実行）"""
+
+    def __init__(self, score_limit: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.score_limit = score_limit
+        self.status = "running"  # running / completed / failed
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.metrics = new_metrics()
+        self._started = time.perf_counter()
+        self._elapsed = None
+
+    def run(self):
+        try:
+            self.result = run_refresh(self.score_limit, metrics=self.metrics)
+            self.status = "completed"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+            print(f"[REFRESH] Error: {e}")
+        finally:
+            self._elapsed = time.perf_counter() - self._started
+            self.finished_at = datetime.now().isoformat()
+            # ジョブごとのスレッドなので、保持していた接続をここで閉じる
+            close_connection()
+
+    def snapshot(self) -> dict:
+        """進行中の段・進捗・段ごとの所要時間"""
+        stages = {name: m.snapshot() for name, m in self.metrics.items()}
+        if self.status == "running":
+            # まだ終わっていない最初の段（取得と採点は並行に進む）
+            stage = next((n for n in STAGES if stages[n]["status"] != "done"), STAGES[-1])
+        else:
+            stage = self.status
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._started
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": stage,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "elapsed_sec": round(elapsed, 3),
+            "progress": {
+                "feeds": stages["fetch"]["items_in"],
+                "fetched": stages["fetch"]["items_out"],
+                "inserted": stages["insert"]["items_out"],
+                "scored": stages["score"]["items_out"],
+                "score_limit": self.score_limit
+            },
+            "stages": stages,
+            "errors": ([self.error] if self.error else []) + (self.result or {}).get("errors", [])
+        }
+
+
+_refresh_lock = threading.Lock()
+_refresh_jobs = OrderedDict()  # job_id -> RefreshJob（古い順）
+_current_job: Optional[RefreshJob] = None
+
+
+def start_refresh(score_limit: int) -> tuple:
+    """リフレッシュを開始して (ジョブ, 新規に開始したか) を返す
+
+    実行中のジョブがあれば新しく開始せず、そのジョブを返す（同時に1つだけ）。
+    """
+    global _current_job
+    with _refresh_lock:
+        if _current_job is not None and _current_job.status == "running":
+            return _current_job, False
+        job = RefreshJob(score_limit)
+        _refresh_jobs[job.id] = job
+        while len(_refresh_jobs) > REFRESH_JOB_HISTORY:
+            _refresh_jobs.popitem(last=False)
+        _current_job = job
+        threading.Thread(target=job.run, name=f"refresh-{job.id}", daemon=True).start()
+        return job, True
+
+
+@app.post("/refresh", status_code=202)
+def refresh_feeds(request: RefreshRequest = None):
+    """フィードを更新（専用スレッドで実行。実行中なら同じジョブを返す）"""
     if request is None:
         request = RefreshRequest()
     
-    # バックグラウンドで実行
-    background_tasks.add_task(run_refresh, request.score_limit)
+    job, started = start_refresh(request.score_limit)
     
     return {
-        "status": "started",
-        "message": "Refresh started in background"
+        "status": "started" if started else "running",
+        "job_id": job.id,
+        "status_url": f"/refresh/{job.id}",
+        "message": "Refresh started in background" if started else "Refresh already running"
     }
 
 
-async def run_refresh(score_limit: int):
-    """リフレッシュ処理の実際の実行"""
-    try:
-        # 1. RSSフィード取得
-        fetch_result = fetch_all_feeds()
-        
-        # 2. AIスコアリング
-        score_result = score_articles(limit=score_limit)
-        
-        # 3. JSON出力
-        save_output_json()
-        
-        # 4. 古い記事を削除
-        deleted = cleanup_old_articles()
-        
-        print(f"[REFRESH] Completed - Fetched: {fetch_result['inserted']}, Scored: {score_result['scored']}, Deleted: {deleted}")
-        
-    except Exception as e:
-        print(f"[REFRESH] Error: {e}")
-
-
-@app.get("/stats")
-async def get_stats():
+@app.get("/refresh/{job_id}")
+def get_refresh_status(job_id: str):
+    """リフレッシュの進行状況（段・進捗・段ごとの所要時間）"""
+    job = _refresh_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Refresh job not found")
+    return job.snapshot()
+
+
+def run_refresh(score_limit: int, metrics: Optional[dict] = None) -> dict:
+    """リフレッシュ処理の実際の実行（取得・スコアリング・JSON出力・古い記事の削除）"""
+    result = run_pipeline(score_limit=score_limit, metrics=metrics)
+    
+    print(f"[REFRESH] Completed - Fetched: {result['fetch']['inserted']}, "
+          f"Scored: {result['score'].get('scored', 0)}, Deleted: {result['deleted']}")
+    return result
+
+
+@app.get("/stats", response_class=FastJSONResponse)
+async def get_stats(request: Request):
     """統計情報を取得"""
+    etag = make_etag("stats", get_data_generation(), int(time.time() // STATS_ETAG_INTERVAL))
+    if etag_matches(request, etag):
+        return not_modified(etag)
     stats = get_articles_count()
     feeds = get_feeds_count()
-    return {
+    return FastJSONResponse({
         "feeds": feeds,
         "articles": {
             "total": stats['total'],
             "scored": stats['scored'],
             "high_score": stats['high_score']
-        }
-    }
+        },
+        "scoring_backlog": get_scoring_backlog(),
+        "scoring_retries": get_retry_stats(),
+        "articles_cache": _articles_cache.stats()
+    }, headers={"ETag": etag})
 
 
 # ========== CLIコマンド用 ==========
 
 def run_cli_refresh():
     """CLI用のリフレッシュコマンド（Cronから呼び出し）"""
-    import asyncio
-    asyncio.run(run_refresh(50))
+    run_refresh(50)
 
 
 if __name__ == "__main__":
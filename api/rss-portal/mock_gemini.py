@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+RSS Portal モックGeminiサーバー
+models/{model}:generateContent を模したローカルサーバー（ベンチマーク・動作確認用）
+
+応答の遅延分布、429・5xx、壊れたJSON・途中で切れたJSON、要素の欠落を
+指定した割合で発生させ、リクエスト数とトークン数を数える。
+responseMimeType: application/json（構造化出力）のときはJSONだけを、
+それ以外は実際のモデルのように前置きとコードブロック付きで返す。
+
+使用方法:
+  python mock_gemini.py --port 8765 --latency lognormal:0.3:0.5 --throttle-rate 0.05
+  RSS_PORTAL_API_MODEL_URL=http://127.0.0.1:8765/v1beta/models python cron_job.py
+
+遅延の指定:
+  0.2                 固定（秒）
+  uniform:0.1:0.5     一様分布（最小:最大）
+  lognormal:0.3:0.5   対数正規分布（中央値:σ）
+  exp:0.3             指数分布（平均）
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Union
+
+# 受け付けるパス（/v1beta/models/{model}:generateContent など）
+GENERATE_PATH = re.compile(r"/models/([^/:?]+):generateContent(?:\?|$)")
+
+
+def approx_tokens(text: str) -> int:
+    """トークン数の概算（UTF-8バイト数 / 4）"""
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def parse_latency(spec: Union[str, float]) -> Callable[[random.Random], float]:
+    """遅延の指定を、乱数生成器から秒数を返す関数にする"""
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    kind, _, rest = str(spec).partition(":")
+    params = [float(p) for p in rest.split(":") if p]
+    if not rest:
+        value = float(kind)
+        return lambda rng: value
+    if kind == "uniform":
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = (params + [0.5])[:2]
+        mu = math.log(median)
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == "exp":
+        mean = params[0]
+        return lambda rng: rng.expovariate(1 / mean)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockGemini:
+    """generateContent のモックサーバー
+
+    プロンプト内の [id: N] を見てバッチ形式（JSON配列）、無ければ単体形式で返す。
+    応答時間は latency の分布 + 出力トークン数 × token_latency。
+    各割合は 0.0〜1.0 で、リクエストごとに独立に抽選する。
+      throttle_rate: 429（Retry-After 付き）
+      error_rate: 503
+      malformed_rate: JSONでない文章を返す
+      truncate_rate: 途中で切れたJSONを返す（finishReason: MAX_TOKENS）
+      drop_rate: バッチの要素を欠落させる（要素ごと）
+    maxOutputTokens を超える応答も途中で切る。
+    """
+
+    def __init__(
+        self,
+        latency: Union[str, float] = 0.2,
+        token_latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 0.5,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        truncate_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.latency = parse_latency(latency)
+        self.token_latency = token_latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.truncate_rate = truncate_rate
+        self.drop_rate = drop_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        """カウンターを0に戻す"""
+        with self._lock:
+            self.counters = {
+                "requests": 0,
+                "structured": 0,
+                "ok": 0,
+                "throttled": 0,
+                "server_errors": 0,
+                "malformed": 0,
+                "truncated": 0,
+                "dropped_items": 0,
+                "prompt_tokens": 0,
+                "output_tokens": 0,
+            }
+            self.latencies = []
+
+    def stats(self) -> dict:
+        """カウンターと、サーバー側で計測した応答時間"""
+        with self._lock:
+            return {**self.counters, "latencies": list(self.latencies)}
+
+    def _draw(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._rng.random() < rate
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, value in amounts.items():
+                self.counters[key] += value
+
+    # ---------- 応答の組み立て ----------
+
+    def respond(self, payload: dict) -> tuple:
+        """リクエストの内容から (ステータス, ヘッダー, 本文) を返す"""
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        generation_config = payload.get("generationConfig", {})
+        max_tokens = generation_config.get("maxOutputTokens") or 8192
+        structured = generation_config.get("responseMimeType") == "application/json"
+        self._count(requests=1, structured=int(structured))
+
+        if self._draw(self.throttle_rate):
+            self._count(throttled=1)
+            body = {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}
+            return 429, {"Retry-After": str(self.retry_after)}, body
+        if self._draw(self.error_rate):
+            self._count(server_errors=1)
+            return 503, {}, {"error": {"code": 503, "status": "UNAVAILABLE"}}
+
+        text = self.generate_text(prompt)
+        if not structured:
+            text = f"以下が評価結果です。\n\n```json\n{text}\n```\n"
+        finish_reason = "STOP"
+        if self._draw(self.malformed_rate):
+            self._count(malformed=1)
+            text = "申し訳ありません。この記事の関連度は高めだと思います（スコア: 4程度）。"
+        elif self._draw(self.truncate_rate):
+            self._count(truncated=1)
+            text = text[:max(1, len(text) // 2)]
+            finish_reason = "MAX_TOKENS"
+        if approx_tokens(text) > max_tokens:
+            # 出力トークン上限で切れた応答
+            text = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", "ignore")
+            finish_reason = "MAX_TOKENS"
+
+        prompt_tokens = approx_tokens(prompt)
+        output_tokens = approx_tokens(text)
+        self._count(ok=1, prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+        return 200, {}, {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": finish_reason,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+        }
+
+    def generate_text(self, prompt: str) -> str:
+        """採点結果のJSON（記事IDからスコアを決める）"""
+        ids = [int(i) for i in re.findall(r"\[id: (\d+)\]", prompt)]
+        if not ids:
+            return json.dumps({"score": 3, "summary": "記事の要約"}, ensure_ascii=False)
+        kept = [i for i in ids if not self._draw(self.drop_rate)]
+        self._count(dropped_items=len(ids) - len(kept))
+        return json.dumps(
+            [{"id": i, "score": i % 5 + 1, "summary": f"記事{i}の要約"} for i in kept],
+            ensure_ascii=False,
+        )
+
+    # ---------- HTTPサーバー ----------
+
+    def handler_class(self):
+        """このモックに応答させるリクエストハンドラー"""
+        mock = self
+
+        class GeminiHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                start = time.perf_counter()
+                if not GENERATE_PATH.search(self.path):
+                    self._send(404, {}, {"error": {"code": 404, "status": "NOT_FOUND"}})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    payload["contents"][0]["parts"][0]["text"]
+                except (ValueError, KeyError, IndexError, TypeError):
+                    self._send(400, {}, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+                    return
+
+                with mock._lock:
+                    delay = mock.latency(mock._rng)
+                status, headers, body = mock.respond(payload)
+                output_tokens = body.get("usageMetadata", {}).get("candidatesTokenCount", 0)
+                time.sleep(max(0.0, delay) + output_tokens * mock.token_latency)
+                self._send(status, headers, body)
+                with mock._lock:
+                    mock.latencies.append(time.perf_counter() - start)
+
+            def _send(self, status: int, headers: dict, body: dict):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return GeminiHandler
+
+    def start(self, port: int = 0) -> "MockGemini":
+        """バックグラウンドのスレッドでサーバーを起動"""
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler_class())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        """API_MODEL_URL に設定するURL"""
+        return f"http://127.0.0.1:{self.server.server_port}/v1beta/models"
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Gemini generateContent server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="0.2")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per output token")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    mock = MockGemini(
+        latency=args.latency,
+        token_latency=args.token_latency,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        truncate_rate=args.truncate_rate,
+        drop_rate=args.drop_rate,
+    )
+    mock.start(args.port)
+    print(f"[INFO] Mock Gemini listening: {mock.url}")
+    print(f"[INFO] Run with: RSS_PORTAL_API_MODEL_URL={mock.url} python cron_job.py")
+    try:
+        while True:
+            time.sleep(60)
+            counters = mock.stats()
+            counters.pop("latencies")
+            print(f"[INFO] {counters}")
+    except KeyboardInterrupt:
+        mock.shutdown()
@@ -0,0 +1,50 @@
+"""
+RSS Portal カーソル（keyset）ページング
+一覧系エンドポイントで共通に使う next_cursor の作成と読み取り
+
+一覧系エンドポイントの約束:
+  - リクエスト: limit（1ページの件数）と cursor（前のページの next_cursor、最初は省略）
+  - レスポンス: next_cursor（次のページが無ければ null）
+  - 並び順は最後に id を含む全順序にし、同じ列の並びのインデックスを用意する
+    （カーソルには最後の行の並び順の列の値を入れ、次のページはその位置から
+    インデックスを検索するので、何ページ目でも1ページ分の件数しか読まない）
+  - カーソルは一覧の名前とページング以外の絞り込み条件に結び付ける
+    （別の一覧・別の条件のカーソルは InvalidCursor になる）
+  - カーソルの中身はクライアントから見て不透明（形式は予告なく変わりうる）
+"""
+
+import base64
+import json
+
+# カーソルの形式のバージョン（変えたら古いカーソルは InvalidCursor になる）
+CURSOR_VERSION = 1
+
+
+class InvalidCursor(ValueError):
+    """読み取れない、または別の一覧・条件のカーソル"""
+
+
+def encode_cursor(listing: str, key: tuple, params: dict) -> str:
+    """最後の行の並び順の値（key）からカーソルを作る
+
+    listing: 一覧の名前（"articles" など）
+    params: ページング以外の絞り込み条件（min_score など）
+    """
+    payload = {"v": CURSOR_VERSION, "l": listing, "k": list(key), "p": params}
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, listing: str, params: dict) -> tuple:
+    """カーソルから並び順の値を取り出す（一覧・条件が作成時と違えば InvalidCursor）"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        version, name, key, bound = payload["v"], payload["l"], payload["k"], payload["p"]
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidCursor("Malformed cursor")
+    if version != CURSOR_VERSION or name != listing or not isinstance(key, list):
+        raise InvalidCursor("Cursor is not for this listing")
+    if bound != params:
+        raise InvalidCursor("Cursor was issued for different query parameters")
+    return tuple(key)
@@ -0,0 +1,303 @@
+"""
+RSS Portal 取得→スコアリングのパイプライン
+フィードの取得・DBへの挿入・AIスコアリングを別スレッドで並行に進める
+
+  fetch --[キュー: PIPELINE_FETCH_QUEUE_SIZE]--> insert --[未スコア件数]--> score --> output
+
+キューが一杯になると取得が待つので、取得済みの記事がメモリにたまり続けない。
+挿入からスコアリングへは件数だけを渡す（記事はDBにあるので、スコアリングが
+遅れても挿入・取得は止まらない）。スコアリングは score_articles と同じ順序
+（再試行待ち → 優先度順の待ち行列）で記事を取り出す。
+JSON出力と古い記事の削除は最後に1回だけ行う。
+取得のワーカーはDBに触れず（既存の記事の確認は取得の段のスレッドで行う）、
+取得・挿入のスレッドは終わるときにDB接続を閉じる（スレッドごとの接続を残さない）。
+"""
+
+import queue
+import threading
+import time
+from typing import Optional
+
+from config import (
+    PIPELINE_FETCH_QUEUE_SIZE,
+    PIPELINE_INSERT_BATCH,
+    PIPELINE_SCORE_LINGER,
+    SCORING_BATCH_SIZE,
+    SCORING_CONCURRENCY
+)
+from database import (
+    insert_articles,
+    update_feeds_fetch_state,
+    cleanup_old_articles,
+    close_connection
+)
+from rss_fetcher import load_feeds, fetch_feeds_concurrently, settle_fetch_states
+from ai_scorer import ScoringRun, score_articles
+from json_output import save_output_json
+
+# 段の名前（処理順）
+STAGES = ("fetch", "insert", "score", "output")
+
+# 上流の段が終わったことを下流に伝える印
+_DONE = object()
+
+
+class StageMetrics:
+    """1つの段の処理件数・稼働時間・入力キューの深さ（別スレッドから読める）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self.depth_max = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    def start(self):
+        with self._lock:
+            self.started_at = time.perf_counter()
+
+    def finish(self):
+        with self._lock:
+            self.finished_at = time.perf_counter()
+
+    def add(self, items_in: int = 0, items_out: int = 0, busy: float = 0.0):
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy += busy
+
+    def observe_depth(self, depth: int):
+        """入力キューの深さを記録"""
+        with self._lock:
+            self.depth_max = max(self.depth_max, depth)
+            self.depth_total += depth
+            self.depth_samples += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            if self.started_at is None:
+                status, wall = "pending", 0.0
+            else:
+                status = "done" if self.finished_at is not None else "running"
+                wall = (self.finished_at or time.perf_counter()) - self.started_at
+            return {
+                "status": status,
+                "items_in": self.items_in,
+                "items_out": self.items_out,
+                "wall_sec": round(wall, 3),
+                "busy_sec": round(self.busy, 3),
+                "per_sec": round(self.items_out / wall, 1) if wall > 0 else 0.0,
+                "queue_depth_max": self.depth_max,
+                "queue_depth_avg": round(self.depth_total / self.depth_samples, 1)
+                if self.depth_samples else 0.0
+            }
+
+
+def new_metrics() -> dict:
+    """段ごとの StageMetrics（run_pipeline の実行中に進捗として読める）"""
+    return {name: StageMetrics(name) for name in STAGES}
+
+
+def merge_score_result(total: dict, part: dict):
+    """score_articles の結果を足し合わせる（件数は合計、辞書は最後の値）"""
+    for key, value in part.items():
+        if isinstance(value, dict):
+            total[key] = value
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def run_pipeline(score_limit: int = 50, metrics: Optional[dict] = None) -> dict:
+    """取得・挿入・スコアリングを並行に実行し、最後にJSON出力と古い記事の削除を行う
+
+    score_limit: この実行で採点する最大記事数（APIの予算）
+    metrics: new_metrics() の戻り値を渡すと、実行中の進捗をそこに書き込む
+    """
+    if metrics is None:
+        metrics = new_metrics()
+    fetch_queue = queue.Queue(maxsize=PIPELINE_FETCH_QUEUE_SIZE)
+    # 挿入済み・未スコアの件数（insert → score の合図）
+    inserted = threading.Condition()
+    signal = {"pending": 0, "done": False}
+    result = {
+        "fetch": {
+            "fetched": 0,
+            "inserted": 0,
+            "duplicates": 0,
+            "feeds_processed": 0,
+            "not_modified": 0
+        },
+        "score": {},
+        "output": None,
+        "deleted": 0,
+        "errors": [],
+        "stages": {}
+    }
+    states = []
+    lost_feeds = set()  # 挿入に失敗した記事のフィード名
+
+    def fetch_stage():
+        stage = metrics["fetch"]
+        stage.start()
+        blocked = 0.0
+        try:
+            feeds = load_feeds()
+            stage.add(items_in=len(feeds))
+            if not feeds:
+                result["errors"].append("No feeds configured")
+                return
+
+            def on_articles(articles: list):
+                nonlocal blocked
+                stage.add(items_out=len(articles))
+                start = time.perf_counter()
+                fetch_queue.put(articles)  # 一杯なら挿入が追いつくまで待つ
+                blocked += time.perf_counter() - start
+                metrics["insert"].observe_depth(fetch_queue.qsize())
+
+            start = time.perf_counter()
+            fetched = fetch_feeds_concurrently(feeds, on_articles=on_articles)
+            stage.add(busy=time.perf_counter() - start - blocked)
+            for key in ("fetched", "feeds_processed", "not_modified"):
+                result["fetch"][key] = fetched[key]
+            states.extend(fetched["states"])
+        except Exception as e:
+            result["errors"].append(f"fetch: {e}")
+        finally:
+            fetch_queue.put(_DONE)
+            stage.finish()
+            close_connection()
+
+    def insert_stage():
+        stage = metrics["insert"]
+        stage.start()
+        pending = []
+
+        def flush():
+            if not pending:
+                return
+            start = time.perf_counter()
+            try:
+                counts = insert_articles(pending)
+            except Exception as e:
+                result["errors"].append(f"insert: {e}")
+                lost_feeds.update(a["feed_name"] for a in pending)
+                counts = {"inserted": 0, "duplicates": 0}
+            stage.add(items_out=counts["inserted"], busy=time.perf_counter() - start)
+            result["fetch"]["inserted"] += counts["inserted"]
+            result["fetch"]["duplicates"] += counts["duplicates"]
+            pending.clear()
+            if counts["inserted"]:
+                with inserted:
+                    signal["pending"] += counts["inserted"]
+                    metrics["score"].observe_depth(signal["pending"])
+                    inserted.notify()
+
+        try:
+            while True:
+                articles = fetch_queue.get()
+                if articles is _DONE:
+                    break
+                stage.add(items_in=len(articles))
+                pending.extend(articles)
+                # 次の記事が届いていなければ、たまった分だけでも挿入して下流に渡す
+                if len(pending) >= PIPELINE_INSERT_BATCH or fetch_queue.empty():
+                    flush()
+            flush()
+        finally:
+            with inserted:
+                signal["done"] = True
+                inserted.notify()
+            stage.finish()
+            close_connection()
+
+    fetcher = threading.Thread(target=fetch_stage, name="pipeline-fetch", daemon=True)
+    inserter = threading.Thread(target=insert_stage, name="pipeline-insert", daemon=True)
+    fetcher.start()
+    inserter.start()
+
+    # スコアリング（このスレッドで実行）
+    stage = metrics["score"]
+    stage.start()
+    chunk = max(1, SCORING_BATCH_SIZE * SCORING_CONCURRENCY)
+    budget = score_limit
+    run = None
+    try:
+        # 優先度の更新・フィードバック文脈・スレッドプールは実行ごとに1回だけ用意する
+        # （この実行で挿入する記事には、挿入時に優先度が付く）
+        run = ScoringRun()
+        while budget > 0:
+            # 1回分（バッチ × 並列数）がたまるか、最初の合図から
+            # PIPELINE_SCORE_LINGER 秒経つまで待つ
+            with inserted:
+                inserted.wait_for(lambda: signal["pending"] or signal["done"])
+                inserted.wait_for(
+                    lambda: signal["pending"] >= chunk or signal["done"],
+                    timeout=PIPELINE_SCORE_LINGER
+                )
+                waiting, upstream_done = signal["pending"], signal["done"]
+                signal["pending"] = 0
+            stage.add(items_in=waiting)
+
+            # 上流が終わったら、残りの予算で再試行待ち・未スコアの記事を採点
+            limit = budget if upstream_done else min(budget, waiting)
+            start = time.perf_counter()
+            scored = score_articles(limit=limit, run=run)
+            stage.add(items_out=scored["processed"], busy=time.perf_counter() - start)
+            merge_score_result(result["score"], scored)
+            budget -= scored["processed"]
+            if upstream_done:
+                break
+    except Exception as e:
+        result["errors"].append(f"score: {e}")
+    finally:
+        if run is not None:
+            try:
+                run.close()
+            except Exception as e:
+                result["errors"].append(f"score: {e}")
+        stage.finish()
+
+    fetcher.join()
+    inserter.join()
+    # 挿入が終わってから次回の条件付きGET用の状態を保存する
+    # （挿入に失敗したフィードは条件なしで取得し直すよう ETag / Last-Modified を消す）
+    update_feeds_fetch_state(settle_fetch_states(states, lost_feeds))
+
+    stage = metrics["output"]
+    stage.start()
+    start = time.perf_counter()
+    try:
+        result["output"] = str(save_output_json())
+        result["deleted"] = cleanup_old_articles()
+    except Exception as e:
+        result["errors"].append(f"output: {e}")
+    stage.add(items_out=1, busy=time.perf_counter() - start)
+    stage.finish()
+
+    result["stages"] = {name: m.snapshot() for name, m in metrics.items()}
+    print_stage_report(result["stages"])
+    return result
+
+
+def print_stage_report(stages: dict):
+    """段ごとの処理件数・時間・キューの深さを表示"""
+    print("[INFO] Pipeline stages:")
+    for name, s in stages.items():
+        print(f"  {name:<6} in {s['items_in']:>5} / out {s['items_out']:>5}  "
+              f"wall {s['wall_sec']:>7.2f}s  busy {s['busy_sec']:>7.2f}s  "
+              f"{s['per_sec']:>7.1f}/s  queue max {s['queue_depth_max']} "
+              f"avg {s['queue_depth_avg']}")
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("RSS Portal Pipeline")
+    print("=" * 50)
+    result = run_pipeline()
+    print(f"\nResult: {result}")
@@ -0,0 +1,220 @@
+"""
+RSS Portal ローカル事前判定モジュール
+過去のAIスコアとフィードバックから学習したナイーブベイズ分類器で、
+明らかに興味のない記事をAPIに送る前に判定する
+
+使用方法:
+  python prefilter.py train      # モデルを学習して保存
+  python prefilter.py evaluate   # 学習データを分割してオフライン評価
+"""
+
+import json
+import math
+import re
+import sys
+import time
+import unicodedata
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from config import (
+    PREFILTER_MODEL_PATH,
+    PREFILTER_MIN_EXAMPLES,
+    PREFILTER_RETRAIN_HOURS,
+    PREFILTER_THRESHOLD
+)
+from database import FALLBACK_SUMMARY, get_training_examples
+
+# 特徴量のハッシュ空間（2^20）
+FEATURE_BUCKETS = 1 << 20
+
+# 「興味なし」とみなすGeminiのスコア上限
+LOW_SCORE = 2
+
+# フィードバックは明示的な意思表示なので、AIスコアより重く数える
+FEEDBACK_WEIGHT = 3
+
+# 事前判定でスコアを付けた記事の要約
+PREFILTER_SUMMARY = "（ローカル判定: 関連度低）"
+
+# Geminiの判定ではないスコア（学習に使わない）
+UNTRUSTED_SUMMARIES = (PREFILTER_SUMMARY, FALLBACK_SUMMARY)
+
+
+def tokenize(title: str, summary: str, feed_name: str) -> set:
+    """記事を特徴量（ハッシュ値）の集合にする
+
+    英数字は単語単位、日本語などは文字2-gram。フィード名も特徴量に含める。
+    """
+    text = unicodedata.normalize('NFKC', f"{title} {(summary or '')[:300]}").lower()
+    tokens = [f"feed:{feed_name or ''}"]
+    tokens.extend(re.findall(r'[a-z0-9+#.]{2,}', text))
+    # ASCII・全角記号・句読点以外の連続（日本語など）
+    for run in re.findall(r'[^\x00-\x7f\u3000-\u303f\uff00-\uffef]+', text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return {zlib.crc32(t.encode('utf-8')) % FEATURE_BUCKETS for t in tokens}
+
+
+def example_label(example: dict) -> Optional[int]:
+    """学習データのラベル（1: 興味なし, 0: それ以外, None: 使わない）"""
+    if example['likes'] or example['clicks']:
+        return 0
+    if example['dislikes']:
+        return 1
+    if example['ai_score'] and example['score_summary'] not in UNTRUSTED_SUMMARIES:
+        return 1 if example['ai_score'] <= LOW_SCORE else 0
+    return None
+
+
+def train(examples: list) -> Optional[dict]:
+    """ナイーブベイズのモデルを学習（データ不足ならNone）"""
+    docs = [0, 0]  # [それ以外, 興味なし]
+    counts = {}
+    total = 0
+    for example in examples:
+        label = example_label(example)
+        if label is None:
+            continue
+        weight = FEEDBACK_WEIGHT if (
+            example['likes'] or example['clicks'] or example['dislikes']
+        ) else 1
+        docs[label] += weight
+        total += 1
+        for feature in tokenize(example['title'], example['summary'], example['feed_name']):
+            pair = counts.setdefault(feature, [0, 0])
+            pair[label] += weight
+
+    if total < PREFILTER_MIN_EXAMPLES or not all(docs):
+        return None
+
+    return {
+        'trained_at': datetime.now().isoformat(),
+        'examples': total,
+        'docs': docs,
+        'counts': counts
+    }
+
+
+def low_probability(model: dict, title: str, summary: str, feed_name: str) -> float:
+    """記事が「興味なし」である確率"""
+    docs = model['docs']
+    counts = model['counts']
+    # ラプラス平滑化した P(特徴あり | クラス) の対数比を足し上げる
+    log_odds = math.log(docs[1] / docs[0])
+    for feature in tokenize(title, summary, feed_name):
+        rest, low = counts.get(feature, (0, 0))
+        log_odds += math.log((low + 1) / (docs[1] + 2)) - math.log((rest + 1) / (docs[0] + 2))
+    log_odds = max(-50.0, min(50.0, log_odds))
+    return 1 / (1 + math.exp(-log_odds))
+
+
+# ========== 保存・読み込み ==========
+
+def save_model(model: dict, path: Path = PREFILTER_MODEL_PATH):
+    """モデルをJSONで保存"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {**model, 'counts': {str(k): v for k, v in model['counts'].items()}}
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    tmp_path.replace(path)
+
+
+_model_cache = {'mtime': None, 'model': None}
+
+
+def load_model(path: Path = PREFILTER_MODEL_PATH) -> Optional[dict]:
+    """保存済みモデルを読み込む（ファイルが更新されるまでは再利用）"""
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    if _model_cache['mtime'] != mtime:
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            data['counts'] = {int(k): v for k, v in data['counts'].items()}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Could not load prefilter model: {e}")
+            return None
+        _model_cache.update(mtime=mtime, model=data)
+    return _model_cache['model']
+
+
+def train_and_save(path: Path = PREFILTER_MODEL_PATH) -> Optional[dict]:
+    """DBの学習データでモデルを学習して保存"""
+    model = train(get_training_examples())
+    if model is None:
+        print(f"[INFO] Not enough labeled articles to train prefilter "
+              f"(need {PREFILTER_MIN_EXAMPLES})")
+        return None
+    save_model(model, path)
+    print(f"[INFO] Prefilter trained on {model['examples']} articles -> {path}")
+    return model
+
+
+def retrain_if_stale(path: Path = PREFILTER_MODEL_PATH) -> bool:
+    """モデルが無いか PREFILTER_RETRAIN_HOURS より古ければ再学習（Cron用）"""
+    try:
+        age_hours = (time.time() - path.stat().st_mtime) / 3600
+    except OSError:
+        age_hours = None
+    if age_hours is not None and age_hours < PREFILTER_RETRAIN_HOURS:
+        return False
+    return train_and_save(path) is not None
+
+
+# ========== オフライン評価 ==========
+
+def evaluate(thresholds: tuple = (0.8, 0.9, 0.95, 0.99), folds: int = 5) -> list:
+    """記事IDで学習用と評価用に分け、しきい値ごとの効果を返す
+
+    saved: 評価データのうちAPI呼び出しを省略できた割合
+    agreement: 省略した記事のうち、Gemini（またはフィードバック）でも「興味なし」だった割合
+    """
+    examples = get_training_examples()
+    rows = {t: {'skipped': 0, 'agreed': 0} for t in thresholds}
+    tested = 0
+    for fold in range(folds):
+        model = train([e for e in examples if e['id'] % folds != fold])
+        if model is None:
+            continue
+        for example in examples:
+            if example['id'] % folds != fold or example_label(example) is None:
+                continue
+            tested += 1
+            p = low_probability(model, example['title'], example['summary'], example['feed_name'])
+            for t in thresholds:
+                if p >= t:
+                    rows[t]['skipped'] += 1
+                    rows[t]['agreed'] += example_label(example) == 1
+
+    report = []
+    for t in thresholds:
+        skipped = rows[t]['skipped']
+        report.append({
+            'threshold': t,
+            'tested': tested,
+            'skipped': skipped,
+            'saved': round(skipped / tested, 3) if tested else 0.0,
+            'agreement': round(rows[t]['agreed'] / skipped, 3) if skipped else None
+        })
+    return report
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "train":
+        train_and_save()
+    elif command == "evaluate":
+        print(f"[INFO] Current threshold: {PREFILTER_THRESHOLD}")
+        for row in evaluate():
+            print(f"  threshold {row['threshold']:.2f}: "
+                  f"API calls saved {row['saved']:.1%} ({row['skipped']}/{row['tested']}), "
+                  f"agreement with Gemini {row['agreement'] if row['agreement'] is not None else '-'}")
+    else:
+        print("Usage: python prefilter.py [train|evaluate]")
@@ -6,20 +6,32 @@ feedparserを使用してRSSフィードから記事を取得
 import calendar
 import hashlib
 import re
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Callable, Optional
+from urllib.parse import urlparse
 
 import feedparser
 import requests as http_requests
 
-from config import DEFAULT_FEEDS, OPML_FILE, MAX_ARTICLES_PER_FETCH
+from config import (
+    DEFAULT_FEEDS,
+    OPML_FILE,
+    MAX_ARTICLES_PER_FETCH,
+    FETCH_CONCURRENCY,
+    FETCH_PER_HOST_LIMIT,
+    FETCH_TIMEOUT
+)
 from database import (
     get_active_feeds,
     add_feed,
     import_feeds_from_opml,
-    article_exists,
-    insert_article,
-    get_feeds_count
+    get_existing_guids,
+    insert_articles,
+    get_feeds_count,
+    update_feeds_fetch_state
 )
 
 
@@ -70,19 +82,56 @@ def get_entry_summary(entry) -> str:
     return clean_html(summary)[:500]
 
 
-def fetch_single_feed(feed_url: str, feed_name: str, max_items: int = 20) -> list:
-    """単一のフィードから記事を取得"""
-    articles = []
-    
+def fetch_feed(
+    feed_url: str,
+    feed_name: str,
+    max_items: int = 20,
+    session: Optional[http_requests.Session] = None,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    skip_existing: bool = True
+) -> dict:
+    """単一のフィードを条件付きGETで取得
+
+    前回の ETag / Last-Modified を送信し、304 の場合は本文を解析しない。
+    skip_existing が False なら既存の記事を除かない（DBに触れないので、
+    呼び出し側が drop_existing でまとめて除く）。
+
+    Returns:
+        {'articles': 記事リスト, 'not_modified': 304ならTrue,
+         'ok': 取得成功ならTrue, 'etag': ..., 'last_modified': ...}
+    """
+    result = {
+        'articles': [],
+        'not_modified': False,
+        'ok': False,
+        'etag': etag,
+        'last_modified': last_modified
+    }
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
     try:
-        response = http_requests.get(feed_url, timeout=30)
+        getter = session.get if session is not None else http_requests.get
+        response = getter(feed_url, headers=headers, timeout=FETCH_TIMEOUT)
+
+        if response.status_code == 304:
+            result['not_modified'] = True
+            result['ok'] = True
+            return result
+
         response.raise_for_status()
         feed = feedparser.parse(response.content)
 
         if feed.bozo and not feed.entries:
             print(f"  [WARN] Parse error: {feed_name}")
-            return articles
+            return result
         
+        candidates = {}
         for entry in feed.entries[:max_items]:
             link = entry.get('link', '')
             title = entry.get('title', '')
@@ -92,12 +141,16 @@ def fetch_single_feed(feed_url: str, feed_name: str, max_items: int = 20) -> lis
             
             # GUID生成（フィード提供のIDがあれば使用）
             guid = entry.get('id') or generate_guid(link, title)
-            
-            # 既存チェック
-            if article_exists(guid):
+            candidates.setdefault(guid, (entry, link, title))
+        
+        # 既存チェック（フィード単位で1回だけ問い合わせ）
+        existing = get_existing_guids(list(candidates)) if skip_existing else set()
+        
+        for guid, (entry, link, title) in candidates.items():
+            if guid in existing:
                 continue
             
-            articles.append({
+            result['articles'].append({
                 'guid': guid,
                 'feed_name': feed_name,
                 'title': clean_html(title),
@@ -105,22 +158,157 @@ def fetch_single_feed(feed_url: str, feed_name: str, max_items: int = 20) -> lis
                 'summary': get_entry_summary(entry),
                 'published_at': parse_published_date(entry)
             })
+
+        result['ok'] = True
+        result['etag'] = response.headers.get('ETag')
+        result['last_modified'] = response.headers.get('Last-Modified')
     
     except Exception as e:
         print(f"  [ERROR] {feed_name}: {e}")
     
-    return articles
+    return result
 
 
-def fetch_all_feeds() -> dict:
-    """全てのフィードから記事を取得してDBに保存"""
-    result = {
-        'fetched': 0,
-        'inserted': 0,
-        'feeds_processed': 0,
-        'errors': []
+def drop_existing(articles: list) -> list:
+    """DBに既にある記事を除く（GUIDをまとめて1回問い合わせ）"""
+    existing = get_existing_guids([a['guid'] for a in articles])
+    return [a for a in articles if a['guid'] not in existing]
+
+
+def fetch_single_feed(
+    feed_url: str,
+    feed_name: str,
+    max_items: int = 20,
+    session: Optional[http_requests.Session] = None
+) -> list:
+    """単一のフィードから記事を取得（条件付きGETなし）"""
+    return fetch_feed(feed_url, feed_name, max_items, session=session)['articles']
+
+
+def fetch_feeds_concurrently(
+    feeds: list,
+    max_workers: int = FETCH_CONCURRENCY,
+    per_host: int = FETCH_PER_HOST_LIMIT,
+    max_articles: int = MAX_ARTICLES_PER_FETCH,
+    on_articles: Optional[Callable[[list], None]] = None
+) -> dict:
+    """複数フィードを並列取得（全体の並列数とホスト単位の並列数を制限）
+
+    ホストごとの待ち行列から、空きのあるホストのフィードだけを投入するため、
+    同一ホストのフィードが多くてもワーカーがブロックされない。
+    on_articles を渡すと、フィードごとの記事をためずにその都度渡す
+    （呼び出し側がブロックすると、その間は新しい取得を投入しない）。
+    ワーカーはHTTPの取得と解析だけを行い、既存の記事の確認はこの関数を
+    呼んだスレッドで行う（ワーカーのスレッドにDB接続を持たせない）。
+
+    Returns:
+        {'articles': 記事リスト（on_articles 指定時は空）, 'fetched': 取得した記事数,
+         'feeds_processed': 処理済みフィード数,
+         'not_modified': 304だったフィード数, 'states': 取得状態のリスト}
+    """
+    max_workers = max(1, max_workers)
+    per_host = max(1, per_host)
+
+    # ホスト単位の待ち行列（OPMLの順序を維持）
+    pending = {}
+    for feed in feeds:
+        host = urlparse(feed['url']).netloc.lower()
+        pending.setdefault(host, deque()).append(feed)
+    active = {host: 0 for host in pending}
+
+    # スレッドごとにSessionを持ち、同一ホストへの接続を再利用
+    local = threading.local()
+
+    def worker(feed: dict) -> dict:
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = http_requests.Session()
+            local.session = session
+        print(f"  Fetching: {feed['name'][:30]}...")
+        return fetch_feed(
+            feed['url'], feed['name'],
+            session=session,
+            etag=feed.get('etag'),
+            last_modified=feed.get('last_modified'),
+            skip_existing=False
+        )
+
+    all_articles = []
+    article_count = 0
+    processed = 0
+    not_modified = 0
+    states = []
+    running = {}  # future -> (host, feed)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def dispatch():
+            for host, queue in pending.items():
+                while queue and active[host] < per_host and len(running) < max_workers:
+                    feed = queue.popleft()
+                    future = executor.submit(worker, feed)
+                    running[future] = (host, feed)
+                    active[host] += 1
+
+        dispatch()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                host, feed = running.pop(future)
+                active[host] -= 1
+                fetched = future.result()
+                if fetched['articles']:
+                    fetched['articles'] = drop_existing(fetched['articles'])
+                article_count += len(fetched['articles'])
+                if on_articles is None:
+                    all_articles.extend(fetched['articles'])
+                elif fetched['articles']:
+                    on_articles(fetched['articles'])
+                processed += 1
+                if fetched['not_modified']:
+                    not_modified += 1
+                if fetched['ok'] and 'id' in feed:
+                    states.append({
+                        'id': feed['id'],
+                        'name': feed['name'],
+                        'etag': fetched['etag'],
+                        'last_modified': fetched['last_modified']
+                    })
+
+            # 最大記事数に達したら新規投入を止め、実行中の取得だけ待つ
+            if article_count >= max_articles:
+                if any(pending.values()):
+                    print(f"[INFO] Reached max articles limit ({max_articles})")
+                    for queue in pending.values():
+                        queue.clear()
+                continue
+            dispatch()
+
+    return {
+        'articles': all_articles,
+        'fetched': article_count,
+        'feeds_processed': processed,
+        'not_modified': not_modified,
+        'states': states
     }
-    
+
+
+def settle_fetch_states(states: list, lost_feeds: set) -> list:
+    """DBに保存できなかった記事のあるフィードの ETag / Last-Modified を消す
+
+    lost_feeds: 挿入に失敗した、または件数の上限で切り捨てた記事のフィード名。
+    そのまま保存すると次回は304になり、失った記事を二度と取得できないため、
+    次回は条件なしで取得し直す。
+    """
+    return [
+        {**state, 'etag': None, 'last_modified': None}
+        if state['name'] in lost_feeds else state
+        for state in states
+    ]
+
+
+def load_feeds() -> list:
+    """OPMLの新しいフィードを取り込み、アクティブなフィードを返す"""
     # 毎回OPMLから新しいフィードをインポート（既存はスキップされる）
     imported = import_feeds_from_opml(OPML_FILE)
     if imported > 0:
@@ -133,45 +321,59 @@ def fetch_all_feeds() -> dict:
             add_feed(feed['name'], feed['url'], feed.get('category', ''))
     
     # アクティブなフィードを取得
-    feeds = get_active_feeds()
+    return get_active_feeds()
+
+
+def fetch_all_feeds() -> dict:
+    """全てのフィードから記事を取得してDBに保存"""
+    result = {
+        'fetched': 0,
+        'inserted': 0,
+        'duplicates': 0,
+        'feeds_processed': 0,
+        'not_modified': 0,
+        'not_modified_rate': 0.0,
+        'errors': []
+    }
+    
+    feeds = load_feeds()
     
     if not feeds:
         result['errors'].append("No feeds configured")
         return result
     
-    print(f"[INFO] Processing {len(feeds)} feeds...")
+    print(f"[INFO] Processing {len(feeds)} feeds "
+          f"(concurrency: {FETCH_CONCURRENCY}, per host: {FETCH_PER_HOST_LIMIT})...")
     
-    all_articles = []
+    fetched = fetch_feeds_concurrently(feeds)
+    all_articles = fetched['articles']
+    result['feeds_processed'] = fetched['feeds_processed']
+    result['not_modified'] = fetched['not_modified']
+    if fetched['feeds_processed']:
+        result['not_modified_rate'] = round(
+            fetched['not_modified'] / fetched['feeds_processed'], 3
+        )
     
-    for feed in feeds:
-        print(f"  Fetching: {feed['name'][:30]}...")
-        articles = fetch_single_feed(feed['url'], feed['name'])
-        all_articles.extend(articles)
-        result['feeds_processed'] += 1
-        
-        # 最大記事数に達したら終了
-        if len(all_articles) >= MAX_ARTICLES_PER_FETCH:
-            print(f"[INFO] Reached max articles limit ({MAX_ARTICLES_PER_FETCH})")
-            break
     
     result['fetched'] = len(all_articles)
     
-    # データベースに挿入
-    for article in all_articles[:MAX_ARTICLES_PER_FETCH]:
-        try:
-            insert_article(
-                guid=article['guid'],
-                feed_name=article['feed_name'],
-                title=article['title'],
-                link=article['link'],
-                summary=article['summary'],
-                published_at=article['published_at']
-            )
-            result['inserted'] += 1
-        except Exception as e:
-            result['errors'].append(str(e))
+    # データベースに一括挿入（1トランザクション）
+    batch = all_articles[:MAX_ARTICLES_PER_FETCH]
+    lost_feeds = {a['feed_name'] for a in all_articles[MAX_ARTICLES_PER_FETCH:]}
+    try:
+        inserted = insert_articles(batch)
+        result['inserted'] = inserted['inserted']
+        result['duplicates'] = inserted['duplicates']
+    except Exception as e:
+        result['errors'].append(str(e))
+        lost_feeds.update(a['feed_name'] for a in batch)
+    
+    # 次回の条件付きGET用に ETag / Last-Modified を保存（挿入のコミット後）
+    update_feeds_fetch_state(settle_fetch_states(fetched['states'], lost_feeds))
     
-    print(f"[INFO] Fetched: {result['fetched']}, Inserted: {result['inserted']}")
+    print(f"[INFO] Fetched: {result['fetched']}, Inserted: {result['inserted']}, "
+          f"Duplicates: {result['duplicates']}, "
+          f"Not modified: {result['not_modified']}/{result['feeds_processed']}")
     return result
 
 